@@ -1,22 +1,123 @@
+import os
+import json
+import logging
 import pandas as pd
+import numpy as np
+import scipy.sparse as sp
+from .cache import make_key, cache_get, cache_set
+from .parallel import run_in_pool
 
-def calculate_bundles(company='animoshop', min_lift=1.1, min_confidence=0.3):
+logger = logging.getLogger(__name__)
+
+# Mínimo de cestas (com 2+ itens) para a análise fazer sentido
+MIN_TRANSACTIONS = 5
+# min_support=0.01 (1%) -> Filtra ruído e foca em padrões recorrentes reais
+MIN_SUPPORT = 0.01
+# Limite de regras devolvidas para não quebrar o frontend
+MAX_RULES = 50
+
+# Repositório de regras (pós-ETL): minerado uma vez com suporte mais baixo;
+# os limiares de lift/confiança/suporte viram filtros SQL.
+RULES_TABLE = 'regra_associacao'
+RULE_ITEMS_TABLE = 'regra_antecedente'
+STORE_MIN_SUPPORT = 0.005
+# Processos para a mineração por marketplace (None = nº de CPUs)
+BUNDLE_WORKERS = int(os.environ.get('BUNDLE_WORKERS', '0')) or None
+
+
+def basket_matrix(df):
+    """
+    One-hot das cestas (pedido x produto) em CSR, montado direto das linhas
+    (produto, id_do_pedido_unificado) com códigos inteiros: memória proporcional
+    ao nº de linhas de pedido, não a pedidos x SKUs.
+    Mesma semântica do TransactionEncoder: só pedidos com 2+ linhas; colunas ordenadas.
+    Retorna (CSR booleana, nomes dos produtos) ou None.
+    """
+    order_codes, _ = pd.factorize(df['id_do_pedido_unificado'])
+    lines_per_order = np.bincount(order_codes)
+    keep = lines_per_order[order_codes] >= 2
+    if not keep.any():
+        return None
+
+    order_codes, orders = pd.factorize(order_codes[keep])
+    if len(orders) < MIN_TRANSACTIONS:
+        return None
+    product_codes, products = pd.factorize(df['produto'].to_numpy()[keep], sort=True)
+
+    matrix = sp.csr_matrix(
+        (np.ones(len(order_codes), dtype=bool), (order_codes, product_codes)),
+        shape=(len(orders), len(products))
+    )
+    # Produto repetido no mesmo pedido conta uma vez (soma de bools -> True)
+    matrix.sum_duplicates()
+    return matrix, [str(p) for p in products]
+
+
+def encode_baskets(df):
+    """Cestas como DataFrame esparso (aceito pelo fpgrowth) ou None."""
+    encoded = basket_matrix(df)
+    if encoded is None:
+        return None
+    matrix, products = encoded
+    return pd.DataFrame.sparse.from_spmatrix(matrix, columns=products)
+
+
+def pair_rules(df, min_support=MIN_SUPPORT, metric="lift", min_threshold=0.0):
+    """
+    Caminho rápido para regras de pares (A -> B): co-ocorrência C = X'X da matriz
+    esparsa de cestas. diag(C) = pedidos com o item, C[a, b] = pedidos com ambos.
+    suporte = C[a,b] / n, confiança = C[a,b] / C[a,a], lift = confiança / suporte(B).
+    Mesmas colunas principais do association_rules (antecedents/consequents frozenset).
+    """
+    encoded = basket_matrix(df)
+    if encoded is None:
+        return None
+    matrix, products = encoded
+    n_orders = matrix.shape[0]
+
+    X = matrix.astype(np.int32)
+    item_count = np.asarray(X.sum(axis=0)).ravel()
+    # Só itens frequentes podem formar pares frequentes (poda antes do produto)
+    frequent = np.flatnonzero(item_count / n_orders >= min_support)
+    if len(frequent) < 2:
+        return None
+    X = X[:, frequent]
+    co = sp.triu(X.T @ X, k=1).tocoo()
+
+    pair_support = co.data / n_orders
+    keep = pair_support >= min_support
+    a, b, both = co.row[keep], co.col[keep], co.data[keep].astype(float)
+    if len(a) == 0:
+        return None
+
+    count = item_count[frequent].astype(float)
+    names = np.array(products, dtype=object)[frequent]
+    # Cada par gera as duas direções
+    ant = np.concatenate([a, b])
+    con = np.concatenate([b, a])
+    both = np.concatenate([both, both])
+    rules = pd.DataFrame({
+        "antecedents": [frozenset([p]) for p in names[ant]],
+        "consequents": [frozenset([p]) for p in names[con]],
+        "antecedent support": count[ant] / n_orders,
+        "consequent support": count[con] / n_orders,
+        "support": both / n_orders,
+        "confidence": both / count[ant],
+    })
+    rules['lift'] = rules['confidence'] / rules['consequent support']
+    return rules[rules[metric] >= min_threshold].reset_index(drop=True)
+
+
+def load_order_lines(company='animoshop', start_date=None, end_date=None, source=None, marketplace=None):
+    """Linhas (produto, pedido, marketplace) com id de pedido preenchido, respeitando os filtros."""
     from .routes import get_filtered_query
-    try:
-        from mlxtend.frequent_patterns import fpgrowth, association_rules
-        from mlxtend.preprocessing import TransactionEncoder
-    except ImportError:
-        print("Erro: mlxtend não instalado.")
-        return []
 
-    
-    # 1. Obter dados
-    base_query, params, conn = get_filtered_query(company)
-    if not base_query: return []
+    base_query, params, conn = get_filtered_query(company, start_date, end_date, source, marketplace)
+    if not base_query: return None
     
     # Busca apenas colunas necessárias para minimizar tráfego e uso de memória
     query = f"""
-        SELECT produto, id_do_pedido_unificado
+        SELECT produto, id_do_pedido_unificado, LOWER(MarketPlace) as marketplace
         FROM ({base_query})
         WHERE id_do_pedido_unificado IS NOT NULL 
           AND id_do_pedido_unificado != ''
@@ -25,57 +126,237 @@ def calculate_bundles(company='animoshop', min_lift=1.1, min_confidence=0.3):
     conn.close()
     
     if df.empty or 'produto' not in df.columns:
-        return []
+        return None
+    return df
 
-    # 2. Agrupa Transações por ID Real
-    # Agrupa produtos por pedido (Cesta de Compras)
-    transactions = df.groupby(['id_do_pedido_unificado'])['produto'].apply(list).tolist()
-    
-    # Filtra transações com < 2 itens (não gera regra, pois precisamos de par para associar)
-    transactions = [t for t in transactions if len(t) >= 2]
-    
-    # Validação mínima de volume
-    if len(transactions) < 5:
-        return [] # Sem dados suficientes para análise estatística
+
+def mine_rules(df, min_support=MIN_SUPPORT, metric="lift", min_threshold=0.0, max_len=None):
+    """
+    Regras de associação (DataFrame no formato do mlxtend) ou None.
+    max_len=2 usa o caminho rápido de pares (X'X); FP-Growth só para itemsets maiores.
+    """
+    if max_len == 2:
+        return pair_rules(df, min_support, metric, min_threshold)
+
+    from mlxtend.frequent_patterns import fpgrowth, association_rules
+
+    # Cestas codificadas direto em matriz esparsa (pedidos x produtos)
+    df_trans = encode_baskets(df)
+    if df_trans is None:
+        return None # Sem dados suficientes para análise estatística
         
-    # 3. One-Hot Encoding
-    te = TransactionEncoder()
-    te_ary = te.fit(transactions).transform(transactions)
-    df_trans = pd.DataFrame(te_ary, columns=te.columns_)
-    
-    # 4. Frequent Itemsets (FPGrowth)
-    # min_support=0.01 (1%) -> Filtra ruído e foca em padrões recorrentes reais
-    frequent_itemsets = fpgrowth(df_trans, min_support=0.01, use_colnames=True)
-    
+    frequent_itemsets = fpgrowth(df_trans, min_support=min_support, use_colnames=True, max_len=max_len)
     if frequent_itemsets.empty:
-        return []
+        return None
         
-    # 5. Association Rules
-    rules = association_rules(frequent_itemsets, metric="lift", min_threshold=min_lift)
+    return association_rules(frequent_itemsets, metric=metric, min_threshold=min_threshold)
+
+
+def format_rule(antecedents, consequents, support, confidence, lift):
+    # Gera frase de recomendação
+    rec_text = f"Quem compra {', '.join(antecedents)} tem alta chance de levar {', '.join(consequents)}"
+    return {
+        "antecedents": antecedents,
+        "consequents": consequents,
+        "support": round(float(support), 4),
+        "confidence": round(float(confidence), 4),
+        "lift": round(float(lift), 4),
+        "recommendation": rec_text
+    }
+
+
+def _bundles_from_lines(df, min_lift, min_confidence, max_len=None):
+    rules = mine_rules(df, MIN_SUPPORT, metric="lift", min_threshold=min_lift, max_len=max_len)
+    if rules is None:
+        return []
     
-    # Filtra confiança
+    # Filtra confiança, ordena por Lift e limita às melhores
     rules = rules[rules['confidence'] >= min_confidence]
+    rules = rules.sort_values(by='lift', ascending=False).head(MAX_RULES)
     
-    # Ordena por Lift
-    # Ordena por Lift e limita a 50 melhores para não quebrar o frontend
-    rules = rules.sort_values(by='lift', ascending=False).head(50)
-    
-    # Formata output para JSON
-    results = []
-    for _, row in rules.iterrows():
-        antecedents = list(row['antecedents'])
-        consequents = list(row['consequents'])
-        
-        # Gera frase de recomendação
-        rec_text = f"Quem compra {', '.join(antecedents)} tem alta chance de levar {', '.join(consequents)}"
-        
-        results.append({
-            "antecedents": antecedents,
-            "consequents": consequents,
-            "support": round(row['support'], 4),
-            "confidence": round(row['confidence'], 4),
-            "lift": round(row['lift'], 4),
-            "recommendation": rec_text
+    return [
+        format_rule(list(a), list(c), s, conf, l)
+        for a, c, s, conf, l in zip(rules['antecedents'], rules['consequents'], rules['support'], rules['confidence'], rules['lift'])
+    ]
+
+
+def _mine_marketplace_task(args):
+    """Worker (processo separado): regras de um marketplace."""
+    marketplace, df, min_lift, min_confidence, max_len = args
+    return marketplace, _bundles_from_lines(df, min_lift, min_confidence, max_len)
+
+
+def calculate_bundles(company='animoshop', min_lift=1.1, min_confidence=0.3, max_len=None,
+                      start_date=None, end_date=None, source=None, marketplace=None, by_marketplace=False):
+    """
+    Mineração sob demanda, respeitando os filtros do dashboard. Resultado em cache por
+    conjunto de filtros até o próximo ETL.
+    max_len=2: só pares, sem FP-Growth (não depende do mlxtend).
+    by_marketplace: cestas de cada marketplace mineradas separadamente (em paralelo);
+    retorna {marketplace: [regras]}.
+    """
+    if max_len != 2:
+        try:
+            import mlxtend  # noqa: F401
+        except ImportError:
+            print("Erro: mlxtend não instalado.")
+            return {} if by_marketplace else []
+
+    key = make_key(company, start_date, end_date, source, (marketplace or '').lower(), min_lift, min_confidence, max_len, by_marketplace)
+    cached = cache_get('bundles', key)
+    if cached is not None:
+        return cached
+
+    df = load_order_lines(company, start_date, end_date, source, marketplace)
+    if df is None:
+        result = {} if by_marketplace else []
+    elif by_marketplace:
+        tasks = [(mp, group[['produto', 'id_do_pedido_unificado']], min_lift, min_confidence, max_len)
+                 for mp, group in df.groupby('marketplace', sort=True)]
+        result = dict(run_in_pool(_mine_marketplace_task, tasks, BUNDLE_WORKERS))
+    else:
+        result = _bundles_from_lines(df, min_lift, min_confidence, max_len)
+
+    cache_set('bundles', key, result)
+    return result
+
+
+def build_rule_store(company='animoshop'):
+    """
+    Etapa pós-ETL: minera todas as regras com suporte >= STORE_MIN_SUPPORT e grava em
+    regra_associacao + regra_antecedente (uma linha por produto do antecedente, indexada).
+    """
+    from sqlalchemy import text
+    from .database import get_db_engine, get_data_version
+
+    t0 = pd.Timestamp.now()
+    df = load_order_lines(company)
+    rules = mine_rules(df, STORE_MIN_SUPPORT, metric="confidence", min_threshold=0.0) if df is not None else None
+    versao = get_data_version(company)
+
+    if rules is None or rules.empty:
+        rules_out = pd.DataFrame(columns=['regra_id', 'antecedentes', 'consequentes', 'n_antecedentes', 'n_itens', 'suporte', 'confianca', 'lift'])
+        items_out = pd.DataFrame(columns=['regra_id', 'produto', 'suporte', 'confianca', 'lift'])
+    else:
+        antecedents = [sorted(a) for a in rules['antecedents']]
+        rules_out = pd.DataFrame({
+            "regra_id": np.arange(len(rules)),
+            "antecedentes": [json.dumps(a, ensure_ascii=False) for a in antecedents],
+            "consequentes": [json.dumps(sorted(c), ensure_ascii=False) for c in rules['consequents']],
+            "n_antecedentes": [len(a) for a in antecedents],
+            "n_itens": [len(a) + len(c) for a, c in zip(antecedents, rules['consequents'])],
+            "suporte": rules['support'].to_numpy(dtype=float),
+            "confianca": rules['confidence'].to_numpy(dtype=float),
+            "lift": rules['lift'].to_numpy(dtype=float),
         })
-        
-    return results
+        sizes = rules_out['n_antecedentes'].to_numpy()
+        items_out = pd.DataFrame({
+            "regra_id": np.repeat(rules_out['regra_id'].to_numpy(), sizes),
+            "produto": [p for a in antecedents for p in a],
+            "suporte": np.repeat(rules_out['suporte'].to_numpy(), sizes),
+            "confianca": np.repeat(rules_out['confianca'].to_numpy(), sizes),
+            "lift": np.repeat(rules_out['lift'].to_numpy(), sizes),
+        })
+    rules_out['versao_dados'] = versao
+    rules_out['gerado_em'] = pd.Timestamp.now().isoformat()
+
+    engine = get_db_engine(company)
+    try:
+        with engine.begin() as conn:
+            rules_out.to_sql(RULES_TABLE, conn, if_exists='replace', index=False)
+            items_out.to_sql(RULE_ITEMS_TABLE, conn, if_exists='replace', index=False)
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_{RULES_TABLE}_id ON {RULES_TABLE} (regra_id)"))
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_{RULES_TABLE}_lift ON {RULES_TABLE} (lift)"))
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_{RULE_ITEMS_TABLE}_produto ON {RULE_ITEMS_TABLE} (produto, lift)"))
+    finally:
+        engine.dispose()
+
+    elapsed = (pd.Timestamp.now() - t0).total_seconds()
+    logger.info(f"Regras de associação {company}: {len(rules_out)} regras em {elapsed:.1f}s")
+    return {"status": "success", "company": company, "rules": len(rules_out)}
+
+
+def _store_is_current(conn, company):
+    from sqlalchemy import inspect, text
+    from .database import get_data_version
+
+    inspector = inspect(conn)
+    if not inspector.has_table(RULES_TABLE):
+        return False
+    # Repositório gerado por versão anterior do esquema: trata como desatualizado
+    if not any(c['name'] == 'n_itens' for c in inspector.get_columns(RULES_TABLE)):
+        return False
+    row = conn.execute(text(f"SELECT versao_dados FROM {RULES_TABLE} LIMIT 1")).fetchone()
+    return row is not None and str(row[0]) == str(get_data_version(company))
+
+
+def get_bundles(company='animoshop', min_lift=1.1, min_confidence=0.3, min_support=MIN_SUPPORT, max_len=None,
+                start_date=None, end_date=None, source=None, marketplace=None, by_marketplace=False):
+    """
+    Sem filtros: regras do repositório pós-ETL filtradas em SQL (mineração sob demanda
+    se desatualizado). Com filtros ou por marketplace: mineração sob demanda com cache.
+    """
+    from .database import get_db_connection
+
+    filtered = (start_date and end_date) or marketplace or source not in (None, 'limpas') or by_marketplace
+    if filtered:
+        return calculate_bundles(company, min_lift, min_confidence, max_len, start_date, end_date, source, marketplace, by_marketplace)
+
+    conn = get_db_connection(company)
+    try:
+        if not _store_is_current(conn, company) or min_support < STORE_MIN_SUPPORT:
+            df = None
+        else:
+            df = pd.read_sql_query(
+                f"""
+                SELECT antecedentes, consequentes, suporte, confianca, lift
+                FROM {RULES_TABLE}
+                WHERE lift >= :min_lift AND confianca >= :min_confidence AND suporte >= :min_support
+                  AND n_itens <= :max_len
+                ORDER BY lift DESC
+                LIMIT {MAX_RULES}
+                """,
+                conn, params={"min_lift": min_lift, "min_confidence": min_confidence, "min_support": min_support, "max_len": max_len or 1_000_000}
+            )
+    finally:
+        conn.close()
+
+    if df is None:
+        return calculate_bundles(company, min_lift, min_confidence, max_len)
+
+    return [
+        format_rule(json.loads(a), json.loads(c), s, conf, l)
+        for a, c, s, conf, l in zip(df['antecedentes'], df['consequentes'], df['suporte'], df['confianca'], df['lift'])
+    ]
+
+
+def get_recommendations(product_name, company='animoshop', limit=10, min_lift=1.0, min_confidence=0.0):
+    """
+    "Quem compra X também leva": regras cujo antecedente contém o produto,
+    via índice (produto, lift) de regra_antecedente. Regras de antecedente único primeiro.
+    """
+    from sqlalchemy import inspect
+    from .database import get_db_connection
+
+    conn = get_db_connection(company)
+    try:
+        if not inspect(conn).has_table(RULE_ITEMS_TABLE):
+            return []
+        df = pd.read_sql_query(
+            f"""
+            SELECT r.antecedentes, r.consequentes, r.suporte, r.confianca, r.lift
+            FROM {RULE_ITEMS_TABLE} i
+            JOIN {RULES_TABLE} r ON r.regra_id = i.regra_id
+            WHERE i.produto = :product AND i.lift >= :min_lift AND i.confianca >= :min_confidence
+            ORDER BY r.n_antecedentes ASC, i.lift DESC, i.confianca DESC
+            LIMIT :limit
+            """,
+            conn, params={"product": product_name, "min_lift": min_lift, "min_confidence": min_confidence, "limit": int(limit)}
+        )
+    finally:
+        conn.close()
+
+    return [
+        format_rule(json.loads(a), json.loads(c), s, conf, l)
+        for a, c, s, conf, l in zip(df['antecedentes'], df['consequentes'], df['suporte'], df['confianca'], df['lift'])
+    ]
@@ -0,0 +1,125 @@
+import os
+import shutil
+import pickle
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from .database import BASE_DIR, get_data_version
+
+logger = logging.getLogger(__name__)
+
+# Cache de resultados/modelos: memória (processo) + disco (sobrevive a restart)
+CACHE_DIR = os.path.join(BASE_DIR, 'cache')
+
+# Memória em LRU limitada; entradas de versões antigas da empresa são descartadas
+# quando a primeira entrada da versão atual é gravada (ver _store)
+MEMORY_MAX_ENTRIES = int(os.environ.get('API_CACHE_MEMORY_MAX', '512'))
+
+_memory = OrderedDict()
+_memory_versions = {}
+_lock = threading.Lock()
+
+
+def _disk_path(namespace, key):
+    # key[0] é sempre a empresa (ver make_key)
+    digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+    return os.path.join(CACHE_DIR, namespace, key[0], f"{digest}.pkl")
+
+
+def _store(namespace, key, value, current_version):
+    """
+    Grava em memória (chamar com _lock). Chave de versão antiga (requisição iniciada antes
+    do ETL) não entra; na primeira chave da versão atual, poda as entradas antigas da
+    empresa. O excesso da LRU sai pelo menos usado.
+    """
+    company = key[0]
+    if key[1] != current_version:
+        return
+    if _memory_versions.get(company) != current_version:
+        stale = [k for k in _memory if k[1][0] == company and k[1][1] != current_version]
+        for k in stale:
+            del _memory[k]
+        _memory_versions[company] = current_version
+    _memory[(namespace, key)] = value
+    _memory.move_to_end((namespace, key))
+    while len(_memory) > MEMORY_MAX_ENTRIES:
+        _memory.popitem(last=False)
+
+
+def make_key(company, *parts):
+    """
+    Chave de cache versionada: (empresa, versão dos dados, *parts).
+    A versão muda a cada carga do ETL, então entradas antigas nunca são servidas.
+    """
+    company = company.lower()
+    return (company, get_data_version(company)) + tuple(parts)
+
+
+def cache_get(namespace, key, disk=True):
+    """Busca em memória e, se não houver, no disco (promovendo para memória)."""
+    with _lock:
+        if (namespace, key) in _memory:
+            _memory.move_to_end((namespace, key))
+            return _memory[(namespace, key)]
+
+    if not disk:
+        return None
+
+    path = _disk_path(namespace, key)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            value = pickle.load(f)
+    except Exception as e:
+        logger.warning(f"Cache corrompido ({namespace}): {e}")
+        return None
+
+    current_version = get_data_version(key[0])
+    with _lock:
+        _store(namespace, key, value, current_version)
+    return value
+
+
+def cache_set(namespace, key, value, disk=True):
+    """Grava em memória e (opcionalmente) no disco de forma atômica."""
+    current_version = get_data_version(key[0])
+    with _lock:
+        _store(namespace, key, value, current_version)
+
+    if not disk:
+        return
+    path = _disk_path(namespace, key)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logger.warning(f"Falha ao persistir cache ({namespace}): {e}")
+
+
+def invalidate(company=None):
+    """
+    Descarta as entradas (de uma empresa ou todas), em memória e em disco.
+    Chamado após o ETL: entradas antigas já não seriam servidas (versão mudou),
+    aqui apenas liberamos espaço.
+    """
+    company = company.lower() if company else None
+
+    with _lock:
+        keys = [k for k in _memory if company is None or k[1][0] == company]
+        for k in keys:
+            del _memory[k]
+        for c in [c for c in _memory_versions if company is None or c == company]:
+            del _memory_versions[c]
+
+    if not os.path.isdir(CACHE_DIR):
+        return
+    if company is None:
+        shutil.rmtree(CACHE_DIR, ignore_errors=True)
+        return
+    for namespace in os.listdir(CACHE_DIR):
+        shutil.rmtree(os.path.join(CACHE_DIR, namespace, company), ignore_errors=True)
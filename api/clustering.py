@@ -1,94 +1,416 @@
+import json
+import logging
 import pandas as pd
 import numpy as np
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from sklearn.preprocessing import StandardScaler
+from sklearn.metrics import silhouette_score, calinski_harabasz_score
+from .cache import make_key, cache_get, cache_set
+from .parallel import run_in_pool
 
-def perform_clustering_from_df(product_stats):
+logger = logging.getLogger(__name__)
+
+N_CLUSTERS = 4
+# Acima deste nº de produtos usa MiniBatchKMeans (KMeans n_init=10 fica caro)
+MINIBATCH_THRESHOLD = 5000
+
+# Quadrantes (faturamento x lucro vs. média): índice = 2 * (abaixo em fat.) + (abaixo em lucro)
+QUADRANTS = [
+    ("Campeões", "#10B981"),         # Green
+    ("Volumosos", "#3B82F6"),        # Blue
+    ("Oportunidades", "#F59E0B"),    # Yellow
+    ("Abaixo da Média", "#9CA3AF"),  # Gray
+]
+
+# Conjuntos de features. 'basic' = comportamento original (faturamento x lucro).
+# 'extended' usa escala log para volumes (caudas longas) e razões para custos.
+FEATURE_SETS = {
+    'basic': ['faturamento', 'lucro_liquido'],
+    'extended': [
+        'log_faturamento', 'margem_pct', 'frete_ratio', 'comissao_ratio',
+        'log_pedidos', 'crescimento_90d', 'n_marketplaces',
+    ],
+}
+# Colunas exibidas por produto no modo 'extended' (valores legíveis, não escalados)
+EXTENDED_OUTPUT = ['margem_pct', 'frete_ratio', 'comissao_ratio', 'crescimento_90d', 'n_marketplaces']
+GROWTH_WINDOW_DAYS = 90
+
+def perform_clustering_from_df(product_stats, auto_k=False, metric='silhouette', features='basic'):
     """
     Executa o clustering K-Means a partir de um DataFrame JÁ AGREGADO.
     Esperado: df com colunas ['produto', 'faturamento', 'lucro', 'quantidade']
+    (+ colunas de feature_query para features='extended').
+    auto_k: escolhe k em K_RANGE pela métrica ('silhouette' ou 'calinski_harabasz').
+    """
+    result, _ = _cluster(_prepare(product_stats, features), auto_k, metric, features)
+    return result
+
+
+def feature_query(base_query, features='basic'):
+    """
+    Agregação por produto numa única passada GROUP BY sobre a base filtrada.
+    'extended' soma também frete/comissões, conta marketplaces distintos e separa o
+    faturamento das duas últimas janelas de 90 dias (relativas à última data do filtro,
+    obtida por window function — sem segunda varredura).
     """
-    # Padroniza colunas para o código abaixo
+    if features != 'extended':
+        return f"""
+            SELECT 
+                produto,
+                SUM(faturamento) as faturamento,
+                SUM(lucro_bruto) as lucro,
+                SUM(contagem_pedidos) as quantidade
+            FROM ({base_query})
+            GROUP BY produto
+        """
+    window = GROWTH_WINDOW_DAYS
+    return f"""
+        SELECT 
+            produto,
+            SUM(faturamento) as faturamento,
+            SUM(lucro_bruto) as lucro,
+            SUM(contagem_pedidos) as quantidade,
+            SUM(ABS(COALESCE(frete, 0))) as frete,
+            SUM(ABS(COALESCE("comissões", 0))) as comissoes,
+            COUNT(DISTINCT LOWER(MarketPlace)) as n_marketplaces,
+            SUM(CASE WHEN idade_dias < {window} THEN faturamento ELSE 0 END) as fat_janela,
+            SUM(CASE WHEN idade_dias >= {window} AND idade_dias < {2 * window} THEN faturamento ELSE 0 END) as fat_janela_anterior
+        FROM (
+            SELECT *, julianday(MAX(data_filtro) OVER ()) - julianday(data_filtro) as idade_dias
+            FROM ({base_query})
+        )
+        GROUP BY produto
+    """
+
+
+def derive_features(product_stats):
+    """Features derivadas por coluna (vetorizado) a partir do resultado de feature_query('extended')."""
+    fat = product_stats['faturamento'].to_numpy(dtype=float)
+    safe_fat = np.where(fat > 0, fat, 1.0)
+    prev = product_stats['fat_janela_anterior'].fillna(0).to_numpy(dtype=float)
+    curr = product_stats['fat_janela'].fillna(0).to_numpy(dtype=float)
+
+    return product_stats.assign(
+        log_faturamento=np.log1p(np.maximum(fat, 0)),
+        margem_pct=np.clip(product_stats['lucro_liquido'].fillna(0).to_numpy(dtype=float) / safe_fat, -1, 1),
+        frete_ratio=np.clip(product_stats['frete'].fillna(0).to_numpy(dtype=float) / safe_fat, 0, 1),
+        comissao_ratio=np.clip(product_stats['comissoes'].fillna(0).to_numpy(dtype=float) / safe_fat, 0, 1),
+        log_pedidos=np.log1p(np.maximum(product_stats['quantidade'].fillna(0).to_numpy(dtype=float), 0)),
+        # Crescimento em log (simétrico e finito mesmo sem vendas na janela anterior)
+        crescimento_90d=np.log1p(np.maximum(curr, 0)) - np.log1p(np.maximum(prev, 0)),
+        n_marketplaces=product_stats['n_marketplaces'].fillna(0).to_numpy(dtype=float),
+    )
+
+
+def _prepare(product_stats, features='basic'):
+    """Padroniza colunas, remove produtos sem faturamento e deriva as features do conjunto."""
     # No SQL renomeamos para 'lucro', mas o codigo original usava 'lucro_liquido'
     if 'lucro' in product_stats.columns:
         product_stats = product_stats.rename(columns={'lucro': 'lucro_liquido'})
-        
-    if product_stats.empty:
-        return []
 
     # Filtra produtos com faturamento zero ou negativo para não sujar a análise
     product_stats = product_stats[product_stats['faturamento'] > 0]
-    
-    if len(product_stats) < 4:
+    if features == 'extended':
+        product_stats = derive_features(product_stats)
+    return product_stats
+
+
+def _feature_matrix(product_stats, features='basic'):
+    return product_stats[FEATURE_SETS[features]].to_numpy(dtype=float)
+
+
+def _cluster(product_stats, auto_k=False, metric='silhouette', features='basic'):
+    """
+    Como perform_clustering_from_df, mas recebe product_stats já passado por _prepare
+    e devolve também o modelo ajustado (ou None).
+    """
+    if len(product_stats) < N_CLUSTERS:
         # Se tiver menos produtos que clusters, não dá pra rodar KMeans
-        return []
+        return [], None
 
     # 3. Preparação para ML (StandardScaler)
     scaler = StandardScaler()
-    X = product_stats[['faturamento', 'lucro_liquido']].values
+    X = _feature_matrix(product_stats, features)
     X_scaled = scaler.fit_transform(X)
 
-    # 4. Aplicar K-Means (k=4)
-    kmeans = KMeans(n_clusters=4, random_state=42, n_init=10)
+    # 4. Aplicar K-Means (k=4 ou automático); MiniBatch para catálogos grandes
+    selection = select_k(X_scaled, metric=metric) if auto_k else None
+    n_clusters = selection['k'] if selection else N_CLUSTERS
+    kmeans = _make_kmeans(n_clusters, len(product_stats))
     clusters = kmeans.fit_predict(X_scaled)
-    product_stats['cluster'] = clusters
-    
-    # 5. Nomeação Dinâmica dos Clusters (Centróides)
-    # Calcula a média real (não normalizada) de cada cluster
-    cluster_centers = product_stats.groupby('cluster')[['faturamento', 'lucro_liquido']].mean()
-    
+
+    # 5-6. Nomeação dos clusters e saída
+    result = format_clusters(product_stats, clusters, n_clusters, features)
+    result['k'] = n_clusters
+    if selection:
+        result['selection'] = selection
+    model = {
+        "k": n_clusters,
+        "auto_k": bool(auto_k),
+        "metric": metric if auto_k else None,
+        "features": features,
+        "scaler_mean": scaler.mean_.tolist(),
+        "scaler_scale": scaler.scale_.tolist(),
+        "centroids": kmeans.cluster_centers_.tolist(),
+        # Distância RMS ao centróide no treino (referência de drift)
+        "ref_dist": float(np.sqrt(np.mean(np.min(kmeans.transform(X_scaled), axis=1) ** 2))),
+        "n_produtos": int(len(product_stats)),
+    }
+    return result, model
+
+
+# --- SELEÇÃO AUTOMÁTICA DE K ---
+
+K_RANGE = range(2, 9)
+K_METRICS = ('silhouette', 'calinski_harabasz')
+# Os k candidatos são avaliados numa amostra (silhouette é O(n²))
+SELECTION_SAMPLE = 3000
+
+
+def _score_k_task(args):
+    """Worker (processo separado): ajusta k na amostra e devolve (k, score)."""
+    k, X_sample, metric = args
+    try:
+        labels = KMeans(n_clusters=k, random_state=42, n_init=3).fit_predict(X_sample)
+        if len(np.unique(labels)) < 2:
+            return k, float('-inf')
+        if metric == 'calinski_harabasz':
+            return k, float(calinski_harabasz_score(X_sample, labels))
+        return k, float(silhouette_score(X_sample, labels))
+    except Exception:
+        return k, float('-inf')
+
+
+def select_k(X_scaled, k_range=K_RANGE, metric='silhouette', sample_size=SELECTION_SAMPLE, max_workers=None):
+    """
+    Avalia cada k em paralelo numa amostra aleatória (reprodutível) e escolhe o maior score.
+    Retorna {"k", "metric", "scores"}.
+    """
+    if metric not in K_METRICS:
+        metric = K_METRICS[0]
+    n = len(X_scaled)
+    if n > sample_size:
+        idx = np.random.default_rng(42).choice(n, sample_size, replace=False)
+        X_sample = X_scaled[idx]
+    else:
+        X_sample = X_scaled
+
+    ks = [k for k in k_range if k < len(X_sample)]
+    scores = dict(run_in_pool(_score_k_task, [(k, X_sample, metric) for k in ks], max_workers))
+    finite = {k: v for k, v in scores.items() if np.isfinite(v)}
+    best = max(finite, key=finite.get) if finite else N_CLUSTERS
+    return {"k": int(best), "metric": metric, "scores": {int(k): (round(v, 4) if np.isfinite(v) else None) for k, v in scores.items()}}
+
+
+def _make_kmeans(n_clusters, n_samples):
+    """KMeans completo até MINIBATCH_THRESHOLD produtos; acima disso MiniBatchKMeans."""
+    if n_samples > MINIBATCH_THRESHOLD:
+        return MiniBatchKMeans(n_clusters=n_clusters, random_state=42, n_init=3, batch_size=2048)
+    return KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
+
+
+def label_clusters(product_stats, clusters, n_clusters):
+    """
+    Nomeação Dinâmica dos Clusters (Centróides): compara a média real (não normalizada)
+    de cada cluster com as médias globais. Com k != 4 vários clusters podem cair no
+    mesmo quadrante. Retorna (índice do quadrante por cluster, médias).
+    """
+    values = product_stats[['faturamento', 'lucro_liquido']].to_numpy(dtype=float)
+    counts = np.bincount(clusters, minlength=n_clusters)
+    sums = np.vstack([np.bincount(clusters, weights=values[:, j], minlength=n_clusters) for j in range(2)]).T
+    centers = sums / np.maximum(counts, 1)[:, None]
+
     # Médias globais para comparação
-    avg_revenue = product_stats['faturamento'].mean()
-    avg_profit = product_stats['lucro_liquido'].mean()
-    
-    cluster_labels = {}
-    
-    for cluster_id in range(4):
-        center_rev = cluster_centers.loc[cluster_id, 'faturamento']
-        center_prof = cluster_centers.loc[cluster_id, 'lucro_liquido']
-        
-        is_high_rev = center_rev >= avg_revenue
-        is_high_prof = center_prof >= avg_profit
-        
-        if is_high_rev and is_high_prof:
-            label = "Campeões"
-            color = "#10B981" # Green
-        elif is_high_rev and not is_high_prof:
-            label = "Volumosos"
-            color = "#3B82F6" # Blue
-        elif not is_high_rev and is_high_prof:
-            label = "Oportunidades"
-            color = "#F59E0B" # Yellow
-        else:
-            label = "Abaixo da Média"
-            color = "#9CA3AF" # Gray
-            
-        cluster_labels[cluster_id] = {'label': label, 'color': color}
-
-    # 6. Formatar Saída
-    output = []
-    for _, row in product_stats.iterrows():
-        cluster_info = cluster_labels[row['cluster']]
-        output.append({
-            "product": row['produto'],
-            "revenue": row['faturamento'],
-            "profit": row['lucro_liquido'],
-            "volume": int(row['quantidade']) if 'quantidade' in row else 0,
-            "cluster": cluster_info['label'],
-            "color": cluster_info['color']
-        })
-        
+    avg_revenue, avg_profit = values.mean(axis=0)
+
+    is_high_rev = centers[:, 0] >= avg_revenue
+    is_high_prof = centers[:, 1] >= avg_profit
+    quadrant = (~is_high_rev).astype(int) * 2 + (~is_high_prof).astype(int)
+    return quadrant, avg_revenue, avg_profit
+
+
+def format_clusters(product_stats, clusters, n_clusters, features='basic'):
+    """Saída JSON montada por colunas (sem iterrows), ordenada por faturamento."""
+    quadrant, avg_revenue, avg_profit = label_clusters(product_stats, clusters, n_clusters)
+    product_quadrant = quadrant[clusters]
+
+    labels = np.array([q[0] for q in QUADRANTS], dtype=object)
+    colors = np.array([q[1] for q in QUADRANTS], dtype=object)
+    volume = product_stats['quantidade'].fillna(0).astype(int) if 'quantidade' in product_stats.columns else 0
+
+    output = pd.DataFrame({
+        "product": product_stats['produto'].to_numpy(),
+        "revenue": product_stats['faturamento'].to_numpy(dtype=float),
+        "profit": product_stats['lucro_liquido'].to_numpy(dtype=float),
+        "volume": volume,
+        "cluster": labels[product_quadrant],
+        "color": colors[product_quadrant],
+    })
+    if features == 'extended':
+        for col in EXTENDED_OUTPUT:
+            output[col] = np.round(product_stats[col].to_numpy(dtype=float), 4)
     # Ordenar por Faturamento Decrescente
-    output.sort(key=lambda x: x['revenue'], reverse=True)
-    
+    output = output.sort_values('revenue', ascending=False, kind='stable')
+
     return {
-        "data": output,
+        "data": output.to_dict(orient='records'),
         "averages": {
-            "revenue": avg_revenue,
-            "profit": avg_profit
-        }
+            "revenue": float(avg_revenue),
+            "profit": float(avg_profit)
+        },
+        "features": FEATURE_SETS[features],
+    }
+
+
+# --- GERAÇÕES DO MODELO (atribuição incremental) ---
+
+MODEL_TABLE = 'cluster_modelo'
+# Refit completo quando a distância RMS ao centróide cresce além deste fator da referência
+DRIFT_THRESHOLD = 1.5
+
+
+def load_generation(company='animoshop', features='basic', auto_k=False, metric='silhouette'):
+    """
+    Última geração persistida (scaler + centróides) do conjunto de features com a mesma
+    configuração de k (auto_k e, se automático, a métrica), ou None.
+    """
+    from sqlalchemy import inspect
+    from .database import get_db_engine
+
+    engine = get_db_engine(company)
+    try:
+        inspector = inspect(engine)
+        if not inspector.has_table(MODEL_TABLE):
+            return None
+        # Gerações anteriores à coluna 'features' são do conjunto 'basic'
+        has_features = any(c['name'] == 'features' for c in inspector.get_columns(MODEL_TABLE))
+        feature_col = "COALESCE(features, 'basic')" if has_features else "'basic'"
+        df = pd.read_sql_query(
+            f"""
+                SELECT * FROM {MODEL_TABLE}
+                WHERE {feature_col} = ? AND auto_k = ? AND (auto_k = 0 OR metric = ?)
+                ORDER BY geracao DESC LIMIT 1
+            """,
+            engine, params=(features, int(bool(auto_k)), metric)
+        )
+    finally:
+        engine.dispose()
+    if df.empty:
+        return None
+
+    row = df.iloc[0]
+    return {
+        "geracao": int(row['geracao']),
+        "k": int(row['k']),
+        "auto_k": bool(row['auto_k']),
+        "metric": row['metric'],
+        "features": features,
+        "scaler_mean": np.array(json.loads(row['scaler_mean'])),
+        "scaler_scale": np.array(json.loads(row['scaler_scale'])),
+        "centroids": np.array(json.loads(row['centroids'])),
+        "ref_dist": float(row['ref_dist']),
     }
 
+
+def save_generation(company, model):
+    """Persiste o modelo como nova geração (histórico mantido na tabela). Retorna o nº da geração."""
+    from sqlalchemy import inspect, text
+    from .database import get_db_engine
+
+    engine = get_db_engine(company)
+    try:
+        with engine.begin() as conn:
+            last = 0
+            inspector = inspect(conn)
+            if inspector.has_table(MODEL_TABLE):
+                last = conn.execute(text(f"SELECT MAX(geracao) FROM {MODEL_TABLE}")).scalar() or 0
+                if not any(c['name'] == 'features' for c in inspector.get_columns(MODEL_TABLE)):
+                    conn.execute(text(f"ALTER TABLE {MODEL_TABLE} ADD COLUMN features TEXT"))
+            generation = int(last) + 1
+            pd.DataFrame([{
+                "geracao": generation,
+                "k": model['k'],
+                "auto_k": int(model['auto_k']),
+                "metric": model['metric'],
+                "features": model['features'],
+                "scaler_mean": json.dumps(model['scaler_mean']),
+                "scaler_scale": json.dumps(model['scaler_scale']),
+                "centroids": json.dumps(model['centroids']),
+                "ref_dist": model['ref_dist'],
+                "n_produtos": model['n_produtos'],
+                "criado_em": pd.Timestamp.now().isoformat(),
+            }]).to_sql(MODEL_TABLE, conn, if_exists='append', index=False)
+    finally:
+        engine.dispose()
+    return generation
+
+
+def assign_clusters(product_stats, generation):
+    """
+    Atribui cada produto ao centróide mais próximo da geração (predict em O(n·k)).
+    Retorna (clusters, drift) — drift = distância RMS atual / referência do treino.
+    """
+    X = _feature_matrix(product_stats, generation['features'])
+    X_scaled = (X - generation['scaler_mean']) / generation['scaler_scale']
+    sq_dist = ((X_scaled[:, None, :] - generation['centroids'][None, :, :]) ** 2).sum(axis=2)
+    clusters = sq_dist.argmin(axis=1)
+    rms = float(np.sqrt(sq_dist[np.arange(len(clusters)), clusters].mean()))
+    drift = rms / generation['ref_dist'] if generation['ref_dist'] > 0 else float('inf')
+    return clusters, drift
+
+
+def _generation_matches(generation, auto_k, metric):
+    if generation is None or generation['auto_k'] != bool(auto_k):
+        return False
+    return not auto_k or generation['metric'] == metric
+
+
+def get_clustering(company='animoshop', start_date=None, end_date=None, source=None, marketplace=None, auto_k=False, metric='silhouette', features='basic'):
+    """
+    Clustering de produtos com cache por conjunto de filtros até o próximo ETL.
+    features: 'basic' (faturamento x lucro) ou 'extended' (ver FEATURE_SETS).
+
+    Usa a última geração persistida (scaler + centróides) para só atribuir os produtos
+    (novos ou filtrados). Refit completo apenas sem geração compatível ou com drift acima
+    de DRIFT_THRESHOLD; o refit vira nova geração quando feito sobre o catálogo inteiro.
+    """
+    if features not in FEATURE_SETS:
+        return {"status": "error", "message": f"Conjunto de features inválido: {features}. Use {', '.join(FEATURE_SETS)}."}
+
+    key = make_key(company, start_date, end_date, source, marketplace, auto_k, metric if auto_k else None, features)
+    cached = cache_get('clustering', key)
+    if cached is not None:
+        return cached
+
+    from .routes import get_filtered_query
+
+    base_query, params, conn = get_filtered_query(company, start_date, end_date, source, marketplace)
+    if not base_query: return []
+
+    df = pd.read_sql_query(feature_query(base_query, features), conn, params=params)
+    conn.close()
+
+    product_stats = _prepare(df, features)
+    if len(product_stats) < N_CLUSTERS:
+        return []
+
+    generation = load_generation(company, features, auto_k, metric)
+    if _generation_matches(generation, auto_k, metric):
+        clusters, drift = assign_clusters(product_stats, generation)
+        if drift <= DRIFT_THRESHOLD:
+            result = format_clusters(product_stats, clusters, generation['k'], features)
+            result.update({"k": generation['k'], "generation": generation['geracao'], "drift": round(drift, 3)})
+            cache_set('clustering', key, result)
+            return result
+        logger.info(f"Clustering {company}: drift {drift:.2f} > {DRIFT_THRESHOLD}, refit completo.")
+
+    result, model = _cluster(product_stats, auto_k, metric, features)
+    is_full_catalog = not (start_date or end_date or marketplace) and source in (None, 'limpas')
+    if model is not None and is_full_catalog:
+        result['generation'] = save_generation(company, model)
+    cache_set('clustering', key, result)
+    return result
+
 def perform_clustering(start_date=None, end_date=None, source=None, marketplace=None, company='animoshop'):
     """Deprecated: Use perform_clustering_from_df inves disso."""
     # Mantendo apenas para retrocompatibilidade se algo chamar, mas vai quebrar se get_all_sales_data não existir
@@ -0,0 +1,212 @@
+import pandas as pd
+import numpy as np
+import scipy.sparse as sp
+import logging
+from .cache import make_key, cache_get, cache_set
+
+# Configuração de Logger
+logger = logging.getLogger(__name__)
+
+# Elasticidade cruzada entre os top-N produtos por faturamento.
+# Para cada produto i (dias com venda):
+#   Ln(Q_i) = a_i + sum_j b_ij * Ln(P_j)
+# b_ij > 0 -> substitutos (j mais caro, i vende mais); b_ij < 0 -> complementares.
+# Todas as N regressões compartilham a matriz de preços e diferem só na máscara de dias,
+# então as equações normais saem de um único einsum e um solve em lote.
+
+CROSS_TABLE = 'elasticidade_cruzada'
+DEFAULT_TOP_N = 20
+# Observações mínimas além do nº de parâmetros da regressão
+MIN_EXTRA_OBS = 10
+T_CRIT = 1.96
+ALL_MARKETPLACES = 'todos'
+
+
+def load_price_panel(company='animoshop', top_n=DEFAULT_TOP_N, source='limpas', marketplace=None, start_date=None, end_date=None):
+    """
+    Painel produto x dia (top-N por faturamento) numa única query agrupada.
+    Retorna {"products", "days", "quantity": CSR [N x T], "price": CSR [N x T]} ou None.
+    Só os dias com venda ocupam memória (matrizes esparsas).
+    """
+    from .routes import get_filtered_query
+
+    base_query, params, conn = get_filtered_query(company, start_date, end_date, source, marketplace)
+    if not base_query:
+        return None
+    try:
+        query = f"""
+            SELECT
+                produto,
+                date(data_filtro) as dia_venda,
+                AVG(faturamento * 1.0 / CASE WHEN contagem_pedidos = 0 THEN 1 ELSE contagem_pedidos END) as preco_unitario,
+                SUM(contagem_pedidos) as contagem_pedidos,
+                SUM(faturamento) as faturamento
+            FROM ({base_query})
+            WHERE produto IS NOT NULL AND data_filtro IS NOT NULL
+            GROUP BY produto, dia_venda
+        """
+        # Alias != 'dia': no GROUP BY o SQLite resolveria 'dia' para a coluna da base (dia do mês)
+        df = pd.read_sql_query(query, conn, params=params)
+    finally:
+        conn.close()
+
+    df = df[(df['contagem_pedidos'] > 0) & (df['preco_unitario'] > 0)]
+    if df.empty:
+        return None
+
+    top = df.groupby('produto')['faturamento'].sum().nlargest(top_n).index
+    df = df[df['produto'].isin(top)]
+
+    products = pd.Index(sorted(top))
+    days = pd.Index(sorted(df['dia_venda'].unique()))
+    rows = products.get_indexer(df['produto'])
+    cols = days.get_indexer(df['dia_venda'])
+    shape = (len(products), len(days))
+    return {
+        "products": products.tolist(),
+        "days": days.tolist(),
+        "quantity": sp.csr_matrix((df['contagem_pedidos'].to_numpy(dtype=float), (rows, cols)), shape=shape),
+        "price": sp.csr_matrix((df['preco_unitario'].to_numpy(dtype=float), (rows, cols)), shape=shape),
+    }
+
+
+def _log_price_matrix(price):
+    """
+    Ln(preço) denso [T x N]: nos dias sem venda o preço vigente é o último observado
+    (antes da primeira venda, o primeiro). Feito só para o bloco top-N.
+    """
+    dense = pd.DataFrame(price.toarray().T).replace(0, np.nan)
+    return np.log(dense.ffill().bfill().to_numpy())
+
+
+def cross_elasticity(panel):
+    """
+    Estima a matriz B [N x N] (linha = demanda, coluna = preço) com todas as
+    regressões resolvidas em lote. Retorna DataFrame longo com coeficiente, erro padrão e t.
+    """
+    products = panel['products']
+    qty = panel['quantity'].tocsr()                 # [N x T] esparsa: só dias com venda
+    mask = qty.copy()                               # dias com venda de cada produto
+    mask.data = np.ones_like(mask.data)
+    log_q = qty.copy()
+    log_q.data = np.log(log_q.data)
+
+    log_p = _log_price_matrix(panel['price'])       # [T x N]
+    # Preços sem variação não identificam efeito (colineares com o intercepto)
+    varying = log_p.std(axis=0) > 1e-9
+    X = np.column_stack([np.ones(len(log_p)), log_p[:, varying]])   # [T x p]
+    regressors = [p for p, v in zip(products, varying) if v]
+    n_params = X.shape[1]
+
+    # Equações normais de todas as regressões: X' M_i X e X' M_i y_i.
+    # Produto esparso x denso: a máscara nunca é densificada.
+    outer = np.einsum('tj,tk->tjk', X, X).reshape(len(X), -1)     # [T x p²]
+    xtx = np.asarray(mask @ outer).reshape(-1, n_params, n_params)
+    xty = np.asarray(log_q @ X)
+    yty = np.asarray(log_q.multiply(log_q).sum(axis=1)).ravel()
+    n_obs = np.asarray(mask.sum(axis=1)).ravel()
+
+    xtx_inv = np.linalg.pinv(xtx)
+    coef = np.einsum('ijk,ik->ij', xtx_inv, xty)
+    sse = np.maximum(yty - np.einsum('ij,ij->i', coef, xty), 0)
+    dof = n_obs - n_params
+    valid = dof >= MIN_EXTRA_OBS
+    sigma2 = np.where(valid, sse / np.maximum(dof, 1), np.nan)
+    se = np.sqrt(sigma2[:, None] * np.maximum(np.diagonal(xtx_inv, axis1=1, axis2=2), 0))
+
+    # Descarta o intercepto e monta formato longo (demanda x preço)
+    b, b_se = coef[:, 1:], se[:, 1:]
+    n_targets, n_reg = b.shape
+    out = pd.DataFrame({
+        "produto": np.repeat(products, n_reg),
+        "produto_preco": np.tile(regressors, n_targets),
+        "coeficiente": b.ravel(),
+        "erro_padrao": b_se.ravel(),
+        "n_obs": np.repeat(n_obs.astype(int), n_reg),
+    })
+    out = out[np.repeat(valid, n_reg)].copy()
+    out['t_stat'] = out['coeficiente'] / out['erro_padrao'].replace(0, np.nan)
+
+    significant = out['t_stat'].abs() >= T_CRIT
+    own = out['produto'] == out['produto_preco']
+    out['relacao'] = np.select(
+        [own, significant & (out['coeficiente'] > 0), significant & (out['coeficiente'] < 0)],
+        ['própria', 'substituto', 'complementar'],
+        default='independente'
+    )
+    return out
+
+
+def run_cross_elasticity(company='animoshop', top_n=DEFAULT_TOP_N, source='limpas', marketplace=None):
+    """Job em background: monta o painel, estima a matriz e grava em elasticidade_cruzada."""
+    from sqlalchemy import inspect, text
+    from .database import get_db_engine, get_data_version
+
+    t0 = pd.Timestamp.now()
+    key = make_key(company, top_n, source, (marketplace or '').lower())
+    panel = cache_get('elasticity_panel', key)
+    if panel is None:
+        panel = load_price_panel(company, top_n, source, marketplace)
+        if panel is None:
+            return {"status": "error", "message": "Sem dados."}
+        cache_set('elasticity_panel', key, panel)
+
+    df_out = cross_elasticity(panel)
+    if df_out.empty:
+        return {"status": "error", "message": "Histórico insuficiente para a regressão multivariada."}
+
+    df_out['marketplace'] = (marketplace or ALL_MARKETPLACES).lower()
+    df_out['fonte'] = source
+    df_out['top_n'] = top_n
+    df_out['versao_dados'] = get_data_version(company)
+    df_out['gerado_em'] = pd.Timestamp.now().isoformat()
+
+    engine = get_db_engine(company)
+    try:
+        with engine.begin() as conn:
+            if inspect(conn).has_table(CROSS_TABLE):
+                conn.execute(
+                    text(f"DELETE FROM {CROSS_TABLE} WHERE marketplace = :m AND fonte = :f"),
+                    {"m": df_out['marketplace'].iloc[0], "f": source}
+                )
+            df_out.to_sql(CROSS_TABLE, conn, if_exists='append', index=False)
+            conn.execute(text(
+                f"CREATE INDEX IF NOT EXISTS idx_{CROSS_TABLE}_lookup ON {CROSS_TABLE} (marketplace, fonte, produto)"
+            ))
+    finally:
+        engine.dispose()
+
+    elapsed = (pd.Timestamp.now() - t0).total_seconds()
+    logger.info(f"Elasticidade cruzada {company}: {len(panel['products'])} produtos x {len(panel['days'])} dias em {elapsed:.1f}s")
+    return {"status": "success", "company": company, "products": len(panel['products']), "pairs": len(df_out)}
+
+
+def get_cross_elasticity(company='animoshop', product=None, relation=None, source='limpas', marketplace=None):
+    """Consulta a tabela elasticidade_cruzada (opcionalmente de um produto / tipo de relação)."""
+    from sqlalchemy import inspect
+    from .database import get_db_connection
+
+    conn = get_db_connection(company)
+    try:
+        if not inspect(conn).has_table(CROSS_TABLE):
+            return []
+        query = f"""
+            SELECT produto, produto_preco, coeficiente, erro_padrao, t_stat, relacao, n_obs
+            FROM {CROSS_TABLE}
+            WHERE marketplace = :marketplace AND fonte = :source
+        """
+        params = {"marketplace": (marketplace or ALL_MARKETPLACES).lower(), "source": source}
+        if product:
+            query += " AND produto = :product"
+            params['product'] = product
+        if relation:
+            query += " AND relacao = :relation"
+            params['relation'] = relation
+        query += " ORDER BY produto, ABS(t_stat) DESC"
+        df = pd.read_sql_query(query, conn, params=params)
+    finally:
+        conn.close()
+
+    df = df.round({"coeficiente": 4, "erro_padrao": 4, "t_stat": 2})
+    df = df.astype(object).where(df.notna(), None)
+    return df.to_dict(orient='records')
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 import os
 
 # Determina o diretório raiz do projeto (um nível acima deste arquivo)
@@ -38,3 +38,47 @@ def get_db_connection(company='animoshop'):
     engine = get_db_engine(company)
     conn = engine.connect() # SQLAlchemy Connection
     return conn
+
+# Versão memorizada por empresa: {company: (assinatura do arquivo, versão)}
+_VERSION_MEMO = {}
+
+def _db_file_signature(db_path):
+    """(mtime_ns, tamanho) do banco e do -wal, se houver: muda a cada escrita."""
+    signature = []
+    for path in (db_path, db_path + '-wal'):
+        if os.path.exists(path):
+            st = os.stat(path)
+            signature.append((st.st_mtime_ns, st.st_size))
+    return tuple(signature)
+
+def get_data_version(company='animoshop'):
+    """
+    Versão dos dados carregados, gravada pelo loader (tabela etl_versao) a cada ETL.
+    Usada como chave de cache: muda a cada carga, invalidando modelos/resultados.
+    Fallback: mtime do arquivo do banco (bancos carregados por loaders antigos).
+    Memorizada pela assinatura do arquivo (os.stat): só consulta etl_versao quando o banco muda.
+    """
+    company = company.lower()
+    db_path = DB_PATHS.get(company)
+    if not db_path:
+        raise ValueError(f"Empresa desconhecida: {company}")
+    if not os.path.exists(db_path):
+        return '0'
+
+    signature = _db_file_signature(db_path)
+    memo = _VERSION_MEMO.get(company)
+    if memo and memo[0] == signature:
+        return memo[1]
+
+    version = str(int(os.path.getmtime(db_path)))
+    try:
+        engine = get_db_engine(company)
+        with engine.connect() as conn:
+            row = conn.execute(text("SELECT versao FROM etl_versao LIMIT 1")).fetchone()
+        engine.dispose()
+        if row:
+            version = str(row[0])
+    except Exception:
+        pass
+    _VERSION_MEMO[company] = (signature, version)
+    return version
@@ -1,12 +1,27 @@
+import json
 import pandas as pd
 import numpy as np
 import statsmodels.api as sm
 import logging
+from .logger import SAMPLED
 
 # Configuração de Logger
 logger = logging.getLogger(__name__)
 
 def calculate_elasticity(product_name: str, company='animoshop', start_date=None, end_date=None, source=None, marketplace=None):
+    """
+    Elasticidade de um produto. Sem intervalo de datas customizado, lê o resultado
+    pré-calculado no pós-ETL (lookup indexado); cálculo sob demanda só para intervalos
+    customizados ou quando a tabela não tem a versão atual dos dados.
+    """
+    if not (start_date and end_date):
+        precomputed = lookup_elasticity(product_name, company, source, marketplace)
+        if precomputed is not None:
+            return precomputed
+    return compute_elasticity(product_name, company, start_date, end_date, source, marketplace)
+
+
+def compute_elasticity(product_name: str, company='animoshop', start_date=None, end_date=None, source=None, marketplace=None):
     """
     Calcula a Elasticidade-Preço da Demanda usando Modelo Log-Log.
     Ln(Q) = alpha + beta * Ln(P)
@@ -163,7 +178,7 @@ def calculate_elasticity(product_name: str, company='animoshop', start_date=None
             "warning": warning_msg
         }
         
-        logger.info(f"Elasticidade calculada para {product_name}: E={elasticity:.2f}, R2={r_squared:.2f}")
+        logger.info(f"Elasticidade calculada para {product_name}: E={elasticity:.2f}, R2={r_squared:.2f}", extra=SAMPLED)
         return result
 
     except Exception as e:
@@ -174,3 +189,291 @@ def calculate_elasticity(product_name: str, company='animoshop', start_date=None
             "status": "error", 
             "message": str(e)
         }
+
+
+# --- ELASTICIDADE EM LOTE (catálogo inteiro) ---
+
+ELASTICITY_TABLE = 'elasticidade_produto'
+MIN_OBSERVATIONS = 5
+ALL_MARKETPLACES = 'todos'
+# Grade do gráfico: mesmos 20 pontos entre 50% e 150% do preço médio do cálculo individual
+CHART_POINTS = 20
+LOW_R2 = 0.3
+
+
+def load_daily_price_qty(company='animoshop', start_date=None, end_date=None, source=None, marketplace=None):
+    """
+    Uma única query para todos os produtos: preço unitário médio e pedidos por (produto, dia).
+    Mesma definição do cálculo individual (faturamento / pedidos, pedidos = 0 conta como 1).
+    """
+    from .routes import get_filtered_query
+
+    base_query, params, conn = get_filtered_query(company, start_date, end_date, source, marketplace)
+    if not base_query:
+        return None
+    try:
+        query = f"""
+            SELECT
+                produto,
+                data_filtro,
+                AVG(faturamento * 1.0 / CASE WHEN contagem_pedidos = 0 THEN 1 ELSE contagem_pedidos END) as preco_unitario,
+                SUM(contagem_pedidos) as contagem_pedidos
+            FROM ({base_query})
+            WHERE produto IS NOT NULL
+            GROUP BY produto, data_filtro
+        """
+        return pd.read_sql_query(query, conn, params=params)
+    finally:
+        conn.close()
+
+
+def batch_elasticity(daily):
+    """
+    Regressão log-log Ln(Q) = alpha + beta * Ln(P) por produto em forma fechada.
+    Somas agrupadas (np.bincount) de x, y, x², xy, y² já centradas na média do produto:
+        beta = Sxy / Sxx,  R² = Sxy² / (Sxx * Syy),  SE(beta) = sqrt(SSE / (n - 2) / Sxx)
+    Mesmos resultados do OLS do statsmodels, sem um ajuste por produto.
+    Retorna um DataFrame com uma linha por produto (status 'success' ou 'insufficient_data').
+    """
+    from scipy import stats
+
+    daily = daily[(daily['contagem_pedidos'] > 0) & (daily['preco_unitario'] > 0)]
+    codes, products = pd.factorize(daily['produto'])
+    k = len(products)
+    if k == 0:
+        return pd.DataFrame()
+
+    price = daily['preco_unitario'].to_numpy(dtype=float)
+    x = np.log(price)
+    y = np.log(daily['contagem_pedidos'].to_numpy(dtype=float))
+
+    n = np.bincount(codes, minlength=k).astype(float)
+    safe_n = np.maximum(n, 1)
+    x_mean = np.bincount(codes, weights=x, minlength=k) / safe_n
+    y_mean = np.bincount(codes, weights=y, minlength=k) / safe_n
+    xc, yc = x - x_mean[codes], y - y_mean[codes]
+    sxx = np.bincount(codes, weights=xc * xc, minlength=k)
+    sxy = np.bincount(codes, weights=xc * yc, minlength=k)
+    syy = np.bincount(codes, weights=yc * yc, minlength=k)
+    avg_price = np.bincount(codes, weights=price, minlength=k) / safe_n
+
+    # Mesmo critério do cálculo individual: >= 5 dias e preço com variação
+    valid = (n >= MIN_OBSERVATIONS) & (sxx > 1e-12)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        beta = np.where(valid, sxy / sxx, np.nan)
+        alpha = y_mean - beta * x_mean
+        r2 = np.where(valid & (syy > 0), sxy ** 2 / (sxx * syy), np.where(valid, 0.0, np.nan))
+        sse = np.maximum(syy - beta * sxy, 0)
+        se = np.sqrt(sse / np.maximum(n - 2, 1) / sxx)
+    t_crit = stats.t.ppf(0.975, np.maximum(n - 2, 1))
+
+    label = np.where(beta < -1, "Elástico", np.where(beta < 0, "Inelástico", "Anômalo (+)"))
+    charts, optimal = _chart_grids(valid, avg_price, alpha, beta, n, x_mean, sxx, sse, t_crit)
+    return pd.DataFrame({
+        "produto": products,
+        "n_obs": n.astype(int),
+        "preco_medio": avg_price,
+        "elasticidade": beta,
+        "intercepto": alpha,
+        "r2": r2,
+        "erro_padrao": np.where(valid, se, np.nan),
+        "ic_inferior": np.where(valid, beta - t_crit * se, np.nan),
+        "ic_superior": np.where(valid, beta + t_crit * se, np.nan),
+        "classificacao": np.where(valid, label, None),
+        "preco_otimo": optimal,
+        "chart_data": charts,
+        "status": np.where(valid, "success", "insufficient_data"),
+    })
+
+
+def _chart_grids(valid, avg_price, alpha, beta, n, x_mean, sxx, sse, t_crit):
+    """
+    Grade de demanda/receita projetada [produtos x CHART_POINTS] de uma vez.
+    Intervalo de predição (obs) do OLS: s² * (1 + 1/n + (x0 - x̄)² / Sxx).
+    Retorna (chart_data em JSON por produto, preço ótimo da grade).
+    """
+    k = len(valid)
+    charts = np.full(k, None, dtype=object)
+    optimal = np.full(k, np.nan)
+    idx = np.flatnonzero(valid)
+    if len(idx) == 0:
+        return charts, optimal
+
+    steps = np.linspace(0.5, 1.5, CHART_POINTS)
+    prices = avg_price[idx, None] * steps[None, :]
+    lx = np.log(prices)
+    mean = alpha[idx, None] + beta[idx, None] * lx
+    s2 = (sse[idx] / (n[idx] - 2))[:, None]
+    half = t_crit[idx, None] * np.sqrt(s2 * (1 + 1 / n[idx, None] + (lx - x_mean[idx, None]) ** 2 / sxx[idx, None]))
+
+    prices_r = np.round(prices, 2)
+    qty, qty_low, qty_high = np.round(np.exp(mean), 2), np.round(np.exp(mean - half), 2), np.round(np.exp(mean + half), 2)
+    rev, rev_low, rev_high = (np.round(prices * np.exp(v), 2) for v in (mean, mean - half, mean + half))
+
+    best = np.argmax(rev, axis=1)
+    optimal[idx] = prices_r[np.arange(len(idx)), best]
+    keys = ("price", "demand_qty", "demand_qty_lower", "demand_qty_upper",
+            "projected_revenue", "projected_revenue_lower", "projected_revenue_upper")
+    for row, i in enumerate(idx):
+        columns = (prices_r[row], qty[row], qty_low[row], qty_high[row], rev[row], rev_low[row], rev_high[row])
+        charts[i] = json.dumps([dict(zip(keys, point)) for point in zip(*(c.tolist() for c in columns))])
+    return charts, optimal
+
+
+def run_elasticity_batch(company='animoshop', start_date=None, end_date=None, source='limpas', marketplace=None):
+    """
+    Elasticidade de todo o catálogo numa passada; grava em elasticidade_produto
+    (substitui as linhas da mesma fonte/marketplace/janela).
+    """
+    from sqlalchemy import inspect, text
+    from .database import get_db_engine, get_data_version
+
+    t0 = pd.Timestamp.now()
+    daily = load_daily_price_qty(company, start_date, end_date, source, marketplace)
+    if daily is None or daily.empty:
+        return {"status": "error", "message": "Sem dados."}
+
+    df_out = batch_elasticity(daily)
+    if df_out.empty:
+        return {"status": "error", "message": "Sem dados válidos (pedidos e preço > 0)."}
+
+    df_out['marketplace'] = (marketplace or ALL_MARKETPLACES).lower()
+    df_out['fonte'] = source
+    df_out['data_inicio'] = start_date or ''
+    df_out['data_fim'] = end_date or ''
+    df_out['versao_dados'] = get_data_version(company)
+    df_out['gerado_em'] = pd.Timestamp.now().isoformat()
+
+    engine = get_db_engine(company)
+    try:
+        with engine.begin() as conn:
+            inspector = inspect(conn)
+            if inspector.has_table(ELASTICITY_TABLE):
+                # Tabela derivada: se o esquema mudou (colunas novas), recria em vez de migrar
+                existing = {c['name'] for c in inspector.get_columns(ELASTICITY_TABLE)}
+                if not set(df_out.columns) <= existing:
+                    conn.execute(text(f"DROP TABLE {ELASTICITY_TABLE}"))
+            if inspect(conn).has_table(ELASTICITY_TABLE):
+                conn.execute(
+                    text(f"DELETE FROM {ELASTICITY_TABLE} WHERE marketplace = :m AND fonte = :f AND data_inicio = :s AND data_fim = :e"),
+                    {"m": df_out['marketplace'].iloc[0], "f": source, "s": start_date or '', "e": end_date or ''}
+                )
+            df_out.to_sql(ELASTICITY_TABLE, conn, if_exists='append', index=False)
+            conn.execute(text(
+                f"CREATE INDEX IF NOT EXISTS idx_{ELASTICITY_TABLE}_lookup "
+                f"ON {ELASTICITY_TABLE} (marketplace, fonte, data_inicio, data_fim, produto)"
+            ))
+    finally:
+        engine.dispose()
+
+    n_valid = int((df_out['status'] == 'success').sum())
+    elapsed = (pd.Timestamp.now() - t0).total_seconds()
+    logger.info(f"Elasticidade em lote {company}: {n_valid}/{len(df_out)} produtos em {elapsed:.1f}s")
+    return {"status": "success", "company": company, "products": len(df_out), "estimated": n_valid}
+
+
+def list_marketplaces(company='animoshop', source='limpas'):
+    from .routes import get_filtered_query
+
+    base_query, params, conn = get_filtered_query(company, source=source)
+    if not base_query:
+        return []
+    try:
+        df = pd.read_sql_query(
+            f"SELECT DISTINCT LOWER(MarketPlace) as marketplace FROM ({base_query}) WHERE MarketPlace IS NOT NULL AND MarketPlace != ''",
+            conn, params=params
+        )
+    finally:
+        conn.close()
+    return df['marketplace'].tolist()
+
+
+def precompute_elasticity(company='animoshop', source='limpas'):
+    """
+    Etapa pós-ETL: elasticidade + grade do gráfico de todos os produtos, para o
+    histórico inteiro, no total e por marketplace (janela padrão = data_inicio/fim vazias).
+    """
+    results = {}
+    for marketplace in [None] + list_marketplaces(company, source):
+        results[marketplace or ALL_MARKETPLACES] = run_elasticity_batch(company, None, None, source, marketplace)
+    return results
+
+
+def lookup_elasticity(product_name, company='animoshop', source=None, marketplace=None):
+    """
+    Resultado pré-calculado (mesmo formato do cálculo individual) ou None se não houver
+    linha da versão atual dos dados — nesse caso o chamador calcula sob demanda.
+    """
+    from sqlalchemy import inspect
+    from .database import get_db_connection, get_data_version
+
+    conn = get_db_connection(company)
+    try:
+        if not inspect(conn).has_table(ELASTICITY_TABLE):
+            return None
+        df = pd.read_sql_query(
+            f"""
+            SELECT * FROM {ELASTICITY_TABLE}
+            WHERE marketplace = :marketplace AND fonte = :source AND data_inicio = '' AND data_fim = ''
+              AND produto = :product
+            """,
+            conn, params={"marketplace": (marketplace or ALL_MARKETPLACES).lower(), "source": source or 'limpas', "product": product_name}
+        )
+    finally:
+        conn.close()
+
+    if df.empty or str(df['versao_dados'].iloc[0]) != str(get_data_version(company)):
+        return None
+    row = df.iloc[0]
+    if row['status'] != 'success':
+        return {
+            "status": "insufficient_data",
+            "message": "Dados insuficientes ou sem variação de preço para cálculo estatístico."
+        }
+
+    warning_msg = None
+    if row['r2'] < LOW_R2:
+        warning_msg = f"Baixa correlação (R²={row['r2']:.2f}). O resultado pode não ser confiável devido à alta volatilidade ou pouca variação de preço."
+    return {
+        "status": "success",
+        "product_name": product_name,
+        "current_avg_price": round(float(row['preco_medio']), 2),
+        "elasticity": round(float(row['elasticidade']), 2),
+        "elasticity_status": row['classificacao'],
+        "r_squared": round(float(row['r2']), 4),
+        "optimal_price_suggestion": float(row['preco_otimo']),
+        "chart_data": json.loads(row['chart_data']),
+        "warning": warning_msg
+    }
+
+
+def get_elasticity_ranking(company='animoshop', source='limpas', marketplace=None, start_date=None, end_date=None, min_r2=0.0, limit=None):
+    """Ranking (mais elástico primeiro) lido da tabela gerada por run_elasticity_batch."""
+    from sqlalchemy import inspect
+    from .database import get_db_connection
+
+    conn = get_db_connection(company)
+    try:
+        if not inspect(conn).has_table(ELASTICITY_TABLE):
+            return []
+        query = f"""
+            SELECT produto, n_obs, preco_medio, elasticidade, r2, erro_padrao, ic_inferior, ic_superior, classificacao, preco_otimo
+            FROM {ELASTICITY_TABLE}
+            WHERE marketplace = :marketplace AND fonte = :source AND data_inicio = :start AND data_fim = :end
+              AND status = 'success' AND r2 >= :min_r2
+            ORDER BY elasticidade ASC
+        """
+        params = {
+            "marketplace": (marketplace or ALL_MARKETPLACES).lower(), "source": source,
+            "start": start_date or '', "end": end_date or '', "min_r2": min_r2,
+        }
+        if limit:
+            query += " LIMIT :limit"
+            params['limit'] = int(limit)
+        df = pd.read_sql_query(query, conn, params=params)
+    finally:
+        conn.close()
+
+    df = df.round({"preco_medio": 2, "elasticidade": 4, "r2": 4, "erro_padrao": 4, "ic_inferior": 4, "ic_superior": 4})
+    df = df.astype(object).where(df.notna(), None)
+    return df.to_dict(orient='records')
@@ -1,14 +1,331 @@
+import os
 import pandas as pd
 import numpy as np
 import logging
-from datetime import datetime
-from dateutil.relativedelta import relativedelta
 from statsmodels.tsa.holtwinters import ExponentialSmoothing, SimpleExpSmoothing
+from .cache import make_key, cache_get, cache_set
+from .logger import SAMPLED
+from .parallel import run_in_pool
+from .series_store import bucket_expression, refresh_series, load_warm_params, save_warm_params
 
 # Configuração de Logger
 logger = logging.getLogger(__name__)
 
-def generate_forecast(company='animoshop', periods_to_predict=12, granularity='weekly'):
+# Nº de processos para ajustes em paralelo (None = nº de CPUs)
+BATCH_WORKERS = int(os.environ.get('FORECAST_WORKERS', '0')) or None
+
+# Parâmetros por granularidade
+# - Semanal ('weekly'): Resample W-MON, Sazonalidade 52. Ideal para fluxo de caixa curto prazo.
+# - Mensal ('monthly'): Resample ME, Sazonalidade 12. Ideal para orçamento anual.
+GRANULARITY_CONFIG = {
+    'weekly': {
+        'resample_rule': 'W-MON',
+        'seasonal_periods': 52,
+        'min_history_seasonal': 52,   # Mínimo para tentar Sazonalidade (idealmente 2x, mas 1x abre a chance)
+        'min_history_trend': 12,      # Mínimo para Tendência
+    },
+    'monthly': {
+        'resample_rule': 'ME',        # Month End
+        'seasonal_periods': 12,
+        'min_history_seasonal': 24,   # Mensal requer 2 anos para sazonalidade robusta
+        'min_history_trend': 6,       # 6 meses para tendência
+    },
+}
+
+
+def _get_config(granularity):
+    return GRANULARITY_CONFIG['monthly' if granularity == 'monthly' else 'weekly']
+
+
+def load_series(company='animoshop', granularity='weekly', source='limpas', full=False):
+    """
+    Série de faturamento (> 0) reamostrada na granularidade pedida, sem o período
+    pré-operacional. Vem da série persistida (series_store): após um ETL só os
+    buckets finais são relidos do banco. Retorna pd.Series ou None.
+    """
+    series, info = refresh_series(company, granularity, source, _get_config(granularity)['resample_rule'], full)
+    if series is None: return None
+    logger.info(f"Série {granularity} ({info['mode']}): {info['buckets']} buckets atualizados.", extra=SAMPLED)
+    return _trim_leading_zeros(series)
+
+
+def _trim_leading_zeros(df_grouped):
+    """Remove período pré-operacional (zeros iniciais)."""
+    if not df_grouped.empty:
+        first_valid = df_grouped.gt(0).idxmax()
+        if df_grouped[first_valid] > 0:
+            df_grouped = df_grouped.loc[first_valid:]
+    return df_grouped
+
+
+# Modelos candidatos (kwargs do ExponentialSmoothing; 'seasonal_naive' é tratado à parte)
+MODEL_CANDIDATES = {
+    'ses':            {"label": "Simple Custom", "trend": None, "seasonal": None},
+    'holt':           {"label": "Holt Linear", "trend": 'add', "seasonal": None},
+    'holt_damped':    {"label": "Holt Damped", "trend": 'add', "damped_trend": True, "seasonal": None},
+    'hw_add':         {"label": "Holt-Winters", "trend": 'add', "seasonal": 'add'},
+    'hw_add_damped':  {"label": "Holt-Winters Damped", "trend": 'add', "damped_trend": True, "seasonal": 'add'},
+    'hw_mul':         {"label": "Holt-Winters Multiplicativo", "trend": 'add', "seasonal": 'mul'},
+    'seasonal_naive': {"label": "Seasonal Naive", "trend": None, "seasonal": None},
+}
+SEASONAL_SPECS = ('hw_add', 'hw_add_damped', 'hw_mul', 'seasonal_naive')
+TREND_SPECS = ('holt', 'holt_damped')
+
+
+def default_spec(n_obs, granularity='weekly'):
+    """Escolha pelo tamanho do histórico (regra original, usada sem seleção automática)."""
+    config = _get_config(granularity)
+    if n_obs >= config['min_history_seasonal']:
+        return 'hw_add'
+    if n_obs >= config['min_history_trend']:
+        return 'holt'
+    return 'ses'
+
+
+def candidate_specs(ts_data, granularity='weekly'):
+    """Candidatos elegíveis para a série (sazonais exigem histórico; multiplicativo exige série > 0)."""
+    config = _get_config(granularity)
+    n_obs = len(ts_data)
+    specs = ['ses']
+    if n_obs >= config['min_history_trend']:
+        specs += list(TREND_SPECS)
+    if n_obs >= config['min_history_seasonal']:
+        specs += [s for s in SEASONAL_SPECS if s != 'hw_mul' or (ts_data > 0).all()]
+    return specs
+
+
+def _model_label(spec, granularity):
+    label = MODEL_CANDIDATES[spec]['label']
+    return label if spec == 'ses' else f"{label} ({granularity})"
+
+
+def fit_model(ts_data, granularity='weekly', spec=None, warm_params=None):
+    """
+    Ajusta o modelo 'spec' (ou a Seleção Automática pelo tamanho do histórico se None).
+    warm_params: parâmetros de um ajuste anterior do mesmo spec (ver warm_start_params),
+    usados como ponto de partida do otimizador (sem a busca em grade inicial).
+    Retorna dict com model_name, spec, fitted_model (None no fallback/naive), resid_std,
+    fallback_level e naive_season.
+    """
+    config = _get_config(granularity)
+    spec = spec or default_spec(len(ts_data), granularity)
+    model_name = _model_label(spec, granularity)
+
+    try:
+        if spec == 'seasonal_naive':
+            m = config['seasonal_periods']
+            values = ts_data.to_numpy(dtype=float)
+            resid_std = np.std(values[m:] - values[:-m])
+            if resid_std == 0:
+                resid_std = ts_data.mean() * 0.05
+            return {"model_name": model_name, "spec": spec, "fitted_model": None, "resid_std": float(resid_std),
+                    "fallback_level": None, "naive_season": values[-m:].tolist()}
+
+        params = MODEL_CANDIDATES[spec]
+        if spec == 'ses':
+            model = SimpleExpSmoothing(
+                ts_data,
+                initialization_method="estimated"
+            )
+        else:
+            model = ExponentialSmoothing(
+                ts_data,
+                trend=params['trend'],
+                damped_trend=params.get('damped_trend', False),
+                seasonal=params['seasonal'],
+                seasonal_periods=config['seasonal_periods'] if params['seasonal'] else None,
+                initialization_method="estimated"
+            )
+
+        # Fit (warm start quando houver parâmetros anteriores compatíveis)
+        fitted_model = None
+        if warm_params is not None:
+            try:
+                fitted_model = model.fit(start_params=np.asarray(warm_params, dtype=float), use_brute=False)
+            except Exception as e:
+                logger.info(f"Warm start ignorado ({model_name}): {e}", extra=SAMPLED)
+        if fitted_model is None:
+            fitted_model = model.fit()
+
+        # Cálculo do Risco
+        resid_std = np.std(fitted_model.resid)
+        if resid_std == 0:
+            resid_std = ts_data.mean() * 0.05
+
+        return {"model_name": model_name, "spec": spec, "fitted_model": fitted_model, "resid_std": float(resid_std),
+                "fallback_level": None, "naive_season": None}
+
+    except Exception as e:
+        logger.warning(f"Erro Modelagem ({model_name}): {e}. Usando Média Móvel Fallback.")
+        avg_last_4 = ts_data.tail(4).mean()
+        resid_std = ts_data.tail(4).std()
+        if np.isnan(resid_std) or resid_std == 0:
+            resid_std = avg_last_4 * 0.1
+        return {"model_name": "Fallback AVG", "spec": None, "fitted_model": None, "resid_std": float(resid_std),
+                "fallback_level": float(avg_last_4), "naive_season": None}
+
+
+def warm_start_params(fitted_model, spec):
+    """
+    Vetor de parâmetros no formato start_params do statsmodels:
+    [alpha, beta?, gamma?, l0, b0?, phi?, s0..s(m-1)?] (só os estimados pelo modelo).
+    """
+    if fitted_model is None or spec not in MODEL_CANDIDATES:
+        return None
+    candidate = MODEL_CANDIDATES[spec]
+    p = fitted_model.params
+    trend, seasonal, damped = candidate['trend'], candidate['seasonal'], candidate.get('damped_trend', False)
+
+    values = [p['smoothing_level']]
+    if trend: values.append(p['smoothing_trend'])
+    if seasonal: values.append(p['smoothing_seasonal'])
+    values.append(p['initial_level'])
+    if trend: values.append(p['initial_trend'])
+    if damped: values.append(p['damping_trend'])
+    if seasonal: values.extend(np.asarray(p['initial_seasons']).tolist())
+    return [float(v) for v in values]
+
+
+def predict(model_entry, periods_to_predict):
+    """Previsão central a partir de um modelo já ajustado (não reajusta)."""
+    if model_entry.get('naive_season') is not None:
+        season = model_entry['naive_season']
+        return [season[i % len(season)] for i in range(periods_to_predict)]
+    if model_entry['fitted_model'] is None:
+        return [model_entry['fallback_level']] * periods_to_predict
+    return model_entry['fitted_model'].forecast(periods_to_predict).tolist()
+
+
+# --- SELEÇÃO AUTOMÁTICA DE MODELO ---
+
+SELECTION_CRITERIA = ('holdout', 'aic')
+
+
+def _holdout_size(n_obs, granularity):
+    """Janela de validação: 1/4 da série, limitada a 1 ciclo curto (13 semanas / 6 meses)."""
+    return max(2, min(n_obs // 4, 6 if granularity == 'monthly' else 13))
+
+
+def _evaluate_candidate_task(args):
+    """
+    Worker (processo separado): pontua um candidato.
+    holdout -> MAE na janela final (ajuste sem ela); aic -> AIC do ajuste completo.
+    """
+    spec, series, granularity, criterion = args
+    try:
+        if criterion == 'aic':
+            entry = fit_model(series, granularity, spec)
+            if entry['spec'] != spec or entry['fitted_model'] is None:
+                return spec, float('inf')
+            return spec, float(entry['fitted_model'].aic)
+
+        h = _holdout_size(len(series), granularity)
+        train, test = series.iloc[:-h], series.iloc[-h:].to_numpy(dtype=float)
+        if spec not in candidate_specs(train, granularity):
+            return spec, float('inf')
+        entry = fit_model(train, granularity, spec)
+        if entry['spec'] != spec:
+            return spec, float('inf')
+        pred = np.asarray(predict(entry, h), dtype=float)
+        return spec, float(np.mean(np.abs(test - pred)))
+    except Exception:
+        return spec, float('inf')
+
+
+def select_model(ts_data, granularity='weekly', criterion='holdout', max_workers=BATCH_WORKERS):
+    """
+    Avalia os candidatos elegíveis em paralelo e escolhe o de menor score.
+    Seasonal Naive não tem verossimilhança, então só concorre por holdout.
+    Retorna {"spec", "criterion", "scores"}.
+    """
+    specs = candidate_specs(ts_data, granularity)
+    if criterion == 'aic':
+        specs = [s for s in specs if s != 'seasonal_naive']
+    tasks = [(spec, ts_data, granularity, criterion) for spec in specs]
+    scores = dict(run_in_pool(_evaluate_candidate_task, tasks, max_workers))
+
+    finite = {s: v for s, v in scores.items() if np.isfinite(v)}
+    best = min(finite, key=finite.get) if finite else default_spec(len(ts_data), granularity)
+    return {"spec": best, "criterion": criterion, "scores": {s: (round(v, 4) if np.isfinite(v) else None) for s, v in scores.items()}}
+
+
+def get_model_selection(company='animoshop', granularity='weekly', source='limpas', series=None, criterion=SELECTION_CRITERIA[0]):
+    """Escolha de modelo da série, em cache até o próximo ETL (versão dos dados na chave)."""
+    key = make_key(company, granularity, source, criterion)
+    selection = cache_get('forecast_selection', key)
+    if selection is None:
+        if series is None:
+            series = load_series(company, granularity, source)
+        selection = select_model(series, granularity, criterion)
+        logger.info(f"Seleção de modelo {granularity} ({criterion}): {selection['spec']} {selection['scores']}", extra=SAMPLED)
+        cache_set('forecast_selection', key, selection)
+    return selection
+
+
+def get_model(company='animoshop', granularity='weekly', source='limpas'):
+    """
+    Model store: série, modelo ajustado e desvio dos resíduos por
+    (empresa, granularidade, fonte), em memória e disco, versionado pela carga do ETL.
+    O modelo é o escolhido pela seleção automática (get_model_selection).
+    """
+    key = make_key(company, granularity, source)
+    entry = cache_get('forecast_model', key)
+    if entry is not None:
+        return entry
+
+    series = load_series(company, granularity, source)
+    if series is None:
+        entry = {"series": None}
+    elif len(series) < 4:
+        entry = {"series": series, "error": f"Dados insuficientes ({len(series)} obs, mínimo 4)."}
+    else:
+        logger.info(f"Forecast {granularity}: {len(series)} observações históricas.", extra=SAMPLED)
+        selection = get_model_selection(company, granularity, source, series)
+        spec = selection['spec']
+        warm = load_warm_params(company, granularity, source, spec)
+        entry = {"series": series, "selection": selection, **fit_model(series, granularity, spec, warm)}
+        save_warm_params(company, granularity, source, entry['spec'], warm_start_params(entry['fitted_model'], entry['spec']))
+
+    cache_set('forecast_model', key, entry)
+    return entry
+
+
+def forecast_dates(last_date, periods_to_predict, granularity='weekly'):
+    """Datas futuras alinhadas à regra de resample (W-MON: segundas; ME: fim de mês)."""
+    rule = _get_config(granularity)['resample_rule']
+    return pd.date_range(last_date, periods=periods_to_predict + 1, freq=rule)[1:]
+
+
+def build_payload(df_grouped, forecast_values, resid_std, granularity='weekly'):
+    """
+    Monta o retorno JSON: histórico + previsão com intervalo de 95%.
+    Fórmula de Risco: 1.96 * Std * sqrt(t), calculada como vetor (NumPy).
+    """
+    n_hist = len(df_grouped)
+    central = np.maximum(np.asarray(forecast_values, dtype=float), 0)
+    n_fut = len(central)
+
+    margin = 1.96 * resid_std * np.sqrt(np.arange(1, n_fut + 1))
+    lower = np.maximum(central - margin, 0)
+    upper = central + margin
+
+    # Colunas (histórico seguido de previsão)
+    dates = df_grouped.index.strftime("%Y-%m-%d").tolist()
+    dates += forecast_dates(df_grouped.index[-1], n_fut, granularity).strftime("%Y-%m-%d").tolist()
+    real = df_grouped.to_numpy(dtype=float).tolist() + [None] * n_fut
+    none_hist = [None] * n_hist
+    fc = none_hist + np.round(central, 2).tolist()
+    lo = none_hist + np.round(lower, 2).tolist()
+    up = none_hist + np.round(upper, 2).tolist()
+    types = ["history"] * n_hist + ["forecast"] * n_fut
+
+    return [
+        {"date": d, "revenue_real": r, "revenue_forecast": f, "revenue_lower": l, "revenue_upper": u, "type": t}
+        for d, r, f, l, u, t in zip(dates, real, fc, lo, up, types)
+    ]
+
+
+def generate_forecast(company='animoshop', periods_to_predict=12, granularity='weekly', source='limpas'):
     """
     Gera Projeção de Faturamento com Granularidade Dinâmica.
     
@@ -20,155 +337,32 @@ def generate_forecast(company='animoshop', periods_to_predict=12, granularity='w
     - Semanal ('weekly'): Resample W-MON, Sazonalidade 52. Ideal para fluxo de caixa curto prazo.
     - Mensal ('monthly'): Resample ME, Sazonalidade 12. Ideal para orçamento anual.
     - Incerteza: Intervalo_t = 1.96 * StdDev * sqrt(t).
+
+    Cache: o modelo ajustado é reutilizado para qualquer 'periods' e o payload
+    final é guardado por (empresa, granularidade, fonte, periods) até o próximo ETL.
     """
     try:
-        # Importação tardia
-        from .routes import get_filtered_query
-        
-        # 1. OBTER DADOS (Faturamento > 0)
-        base_query, params, conn = get_filtered_query(company, source='limpas')
-        if not base_query: return []
-
-        query = f"SELECT data_filtro, faturamento FROM ({base_query}) WHERE faturamento > 0"
-        df_raw = pd.read_sql_query(query, conn, params=params)
-        conn.close()
+        output_key = make_key(company, granularity, source, periods_to_predict)
+        cached = cache_get('forecast_output', output_key)
+        if cached is not None:
+            return cached
 
-        if df_raw.empty: return []
-
-        # 2. PRÉ-PROCESSAMENTO & RESAMPLE
-        df_raw['data_filtro'] = pd.to_datetime(df_raw['data_filtro'])
-        
-        # Lógica de Granularidade
-        resample_rule = 'W-MON'
-        seasonal_periods = 52
-        min_history_seasonal = 52     # Mínimo para tentar Sazonalidade (idealmente 2x, mas 1x abre a chance)
-        min_history_trend = 12        # Mínimo para Tendência
-        
-        if granularity == 'monthly':
-            resample_rule = 'ME'         # Month End
-            seasonal_periods = 12
-            min_history_seasonal = 24    # Mensal requer 2 anos para sazonalidade robusta
-            min_history_trend = 6        # 6 meses para tendência
-        
-        # Agrupa e preenche buracos com 0
-        df_grouped = df_raw.set_index('data_filtro').resample(resample_rule)['faturamento'].sum().fillna(0)
-        
-        # Remove período pré-operacional (zeros iniciais)
-        if not df_grouped.empty:
-            first_valid = df_grouped.gt(0).idxmax()
-            if df_grouped[first_valid] > 0:
-                df_grouped = df_grouped.loc[first_valid:]
-
-        n_obs = len(df_grouped)
-        logger.info(f"Forecast {granularity}: {n_obs} observações históricas.")
-        
-        if n_obs < 4:
-            return [{"error": f"Dados insuficientes ({n_obs} obs, mínimo 4)."}]
-
-        # 3. MODELAGEM (Seleção Automática)
-        forecast_values = []
-        resid_std = 0
-        model_name = ""
-        
-        try:
-            ts_data = df_grouped
-            
-            # Escolha do Modelo Adaptativa
-            if n_obs >= min_history_seasonal:
-                model_name = f"Holt-Winters ({granularity})"
-                model = ExponentialSmoothing(
-                    ts_data,
-                    trend='add',
-                    seasonal='add',
-                    seasonal_periods=seasonal_periods, 
-                    initialization_method="estimated"
-                )
-            elif n_obs >= min_history_trend:
-                model_name = f"Holt Linear ({granularity})"
-                model = ExponentialSmoothing(
-                    ts_data,
-                    trend='add',
-                    seasonal=None,
-                    initialization_method="estimated"
-                )
-            else:
-                model_name = "Simple Custom"
-                model = SimpleExpSmoothing(
-                    ts_data,
-                    initialization_method="estimated"
-                )
-
-            # Fit
-            fitted_model = model.fit()
-            
-            # Previsão Central
-            forecast_result = fitted_model.forecast(periods_to_predict)
-            forecast_values = forecast_result.tolist()
-            
-            # Cálculo do Risco
-            residuals = fitted_model.resid
-            resid_std = np.std(residuals)
-            
-            if resid_std == 0:
-                resid_std = df_grouped.mean() * 0.05
+        # 1-3. SÉRIE + MODELO (model store)
+        entry = get_model(company, granularity, source)
+        if entry['series'] is None: return []
+        if 'error' in entry:
+            return [{"error": entry['error']}]
 
-        except Exception as e:
-            logger.warning(f"Erro Modelagem ({model_name}): {e}. Usando Média Móvel Fallback.")
-            model_name = "Fallback AVG"
-            avg_last_4 = df_grouped.tail(4).mean()
-            forecast_values = [avg_last_4] * periods_to_predict
-            resid_std = df_grouped.tail(4).std()
-            if np.isnan(resid_std) or resid_std == 0:
-                resid_std = avg_last_4 * 0.1
+        df_grouped = entry['series']
+        model_name = entry['model_name']
+        resid_std = entry['resid_std']
+        forecast_values = predict(entry, periods_to_predict)
 
         # 4. CONSTRUÇÃO DO RETORNO JSON
-        final_list = []
-        
-        # A) Histórico
-        for date_idx, val in df_grouped.items():
-            final_list.append({
-                "date": date_idx.strftime("%Y-%m-%d"),
-                "revenue_real": float(val),
-                "revenue_forecast": None,
-                "revenue_lower": None,
-                "revenue_upper": None,
-                "type": "history"
-            })
-            
-        # B) Previsão
-        last_date = df_grouped.index[-1]
-        
-        for i, val_central in enumerate(forecast_values):
-            # Avança a data conforme granularidade
-            step_count = i + 1
-            if granularity == 'monthly':
-                future_date = last_date + relativedelta(months=step_count)
-                # Ajusta para final do mês se a série original for ME
-                # relativedelta preserva dia, mas pd.resample('ME') joga para ultimo dia.
-                # Vamos apenas somar mês a mês.
-                # Melhor: usar DateOffset do pandas se quiser precisão, ou relativedelta.
-                # pd resample ME dates are like 2023-01-31. +1 month -> 2023-02-28?
-                future_date = future_date + relativedelta(day=31) # força final do mes
-            else:
-                future_date = last_date + pd.Timedelta(weeks=step_count)
-            
-            # Fórmula de Risco: 1.96 * Std * sqrt(t)
-            margin = 1.96 * resid_std * np.sqrt(step_count)
-            
-            val_central = max(0, float(val_central))
-            val_lower = max(0, val_central - margin)
-            val_upper = val_central + margin
-            
-            final_list.append({
-                "date": future_date.strftime("%Y-%m-%d"),
-                "revenue_real": None,
-                "revenue_forecast": round(val_central, 2),
-                "revenue_lower": round(val_lower, 2),
-                "revenue_upper": round(val_upper, 2),
-                "type": "forecast"
-            })
-            
-        logger.info(f"Forecast {granularity} generated ({model_name}). Steps={periods_to_predict}")
+        final_list = build_payload(df_grouped, forecast_values, resid_std, granularity)
+
+        logger.info(f"Forecast {granularity} generated ({model_name}). Steps={periods_to_predict}", extra=SAMPLED)
+        cache_set('forecast_output', output_key, final_list)
         return final_list
 
     except Exception as e:
@@ -176,3 +370,167 @@ def generate_forecast(company='animoshop', periods_to_predict=12, granularity='w
         import traceback
         traceback.print_exc()
         return [{"error": str(e)}]
+
+
+# --- FORECAST EM LOTE (por Marketplace / Produto) ---
+
+FORECAST_TABLE = 'forecast_dimensao'
+
+DIMENSION_COLUMNS = {
+    'marketplace': 'marketplace',
+    'produto': 'produto',
+}
+
+
+def load_series_by_dimension(company='animoshop', dimension='marketplace', granularity='weekly', source='limpas', top_n=None):
+    """
+    Lê numa única query o faturamento já agregado por (semana/mês, dimensão)
+    e devolve {chave: pd.Series reamostrada}. top_n limita aos maiores por faturamento.
+    """
+    from .routes import get_filtered_query
+
+    col = DIMENSION_COLUMNS[dimension]
+    base_query, params, conn = get_filtered_query(company, source=source)
+    if not base_query: return {}
+
+    top_filter = ""
+    if top_n:
+        top_filter = f"""
+            AND {col} IN (
+                SELECT {col} FROM ({base_query}) WHERE faturamento > 0
+                GROUP BY {col} ORDER BY SUM(faturamento) DESC LIMIT {int(top_n)}
+            )"""
+
+    rule = _get_config(granularity)['resample_rule']
+    bucket = bucket_expression(rule) or 'data_filtro'
+    query = f"""
+        SELECT {bucket} as data_filtro, {col} as chave, SUM(faturamento) as faturamento
+        FROM ({base_query})
+        WHERE faturamento > 0 AND data_filtro IS NOT NULL AND {col} IS NOT NULL AND {col} != '' {top_filter}
+        GROUP BY 1, {col}
+    """
+    df = pd.read_sql_query(query, conn, params=params)
+    conn.close()
+    if df.empty: return {}
+
+    df['data_filtro'] = pd.to_datetime(df['data_filtro'])
+    wide = df.pivot_table(index='data_filtro', columns='chave', values='faturamento', aggfunc='sum')
+    wide = wide.resample(rule).sum().fillna(0)
+
+    return {key: _trim_leading_zeros(wide[key]) for key in wide.columns}
+
+
+def _fit_predict_task(args):
+    """Worker (processo separado): ajusta e prevê uma série. Retorna (chave, modelo, previsão, resid_std)."""
+    key, series, granularity, periods = args
+    entry = fit_model(series, granularity)
+    return key, entry['model_name'], predict(entry, periods), entry['resid_std']
+
+
+def _forecast_series_task(args):
+    """Worker: como _fit_predict_task, mas devolve o payload pronto (chave, modelo, payload)."""
+    key, series, granularity, periods = args
+    if len(series) < 4:
+        return key, None, []
+    key, model_name, values, resid_std = _fit_predict_task(args)
+    return key, model_name, build_payload(series, values, resid_std, granularity)
+
+
+def forecast_many(series_by_key, granularity='weekly', periods_to_predict=12, max_workers=BATCH_WORKERS):
+    """Ajusta séries independentes em paralelo. Retorna [(chave, modelo, payload)]."""
+    tasks = [(key, series, granularity, periods_to_predict) for key, series in series_by_key.items()]
+    return run_in_pool(_forecast_series_task, tasks, max_workers)
+
+
+def run_forecast_batch(company='animoshop', granularity='weekly', periods_to_predict=12, source='limpas', top_n_products=None, max_workers=BATCH_WORKERS):
+    """
+    Forecast em lote: uma série por marketplace e (opcional) por produto top-N.
+    Resultado gravado na tabela forecast_dimensao (substitui a granularidade/dimensão).
+    """
+    from .database import get_db_engine, get_data_version
+
+    dimensions = [('marketplace', None)]
+    if top_n_products:
+        dimensions.append(('produto', top_n_products))
+
+    engine = get_db_engine(company)
+    versao = get_data_version(company)
+    total = 0
+
+    for dimension, top_n in dimensions:
+        series_by_key = load_series_by_dimension(company, dimension, granularity, source, top_n)
+        if not series_by_key:
+            continue
+
+        t0 = pd.Timestamp.now()
+        results = forecast_many(series_by_key, granularity, periods_to_predict, max_workers)
+
+        frames = []
+        for key, model_name, payload in results:
+            if not payload:
+                continue
+            df_key = pd.DataFrame(payload)
+            df_key['chave'] = key
+            df_key['modelo'] = model_name
+            frames.append(df_key)
+        if not frames:
+            continue
+
+        df_out = pd.concat(frames, ignore_index=True)
+        df_out['dimensao'] = dimension
+        df_out['granularidade'] = granularity
+        df_out['fonte'] = source
+        df_out['versao_dados'] = versao
+        df_out['gerado_em'] = pd.Timestamp.now().isoformat()
+
+        with engine.begin() as conn:
+            _replace_forecast_rows(conn, df_out, dimension, granularity, source)
+
+        total += len(results)
+        elapsed = (pd.Timestamp.now() - t0).total_seconds()
+        logger.info(f"Forecast batch {company}/{dimension}/{granularity}: {len(results)} séries em {elapsed:.1f}s")
+
+    engine.dispose()
+    return {"status": "success", "company": company, "granularity": granularity, "series": total}
+
+
+def _replace_forecast_rows(conn, df_out, dimension, granularity, source):
+    from sqlalchemy import inspect, text
+
+    if inspect(conn).has_table(FORECAST_TABLE):
+        conn.execute(
+            text(f"DELETE FROM {FORECAST_TABLE} WHERE dimensao = :d AND granularidade = :g AND fonte = :f"),
+            {"d": dimension, "g": granularity, "f": source}
+        )
+    df_out.to_sql(FORECAST_TABLE, conn, if_exists='append', index=False)
+    conn.execute(text(
+        f"CREATE INDEX IF NOT EXISTS idx_{FORECAST_TABLE}_lookup "
+        f"ON {FORECAST_TABLE} (dimensao, granularidade, chave)"
+    ))
+
+
+def get_forecast_by_dimension(company='animoshop', dimension='marketplace', key=None, granularity='weekly', source='limpas'):
+    """Consulta a tabela forecast_dimensao (gerada por run_forecast_batch)."""
+    from sqlalchemy import inspect
+    from .database import get_db_connection
+
+    conn = get_db_connection(company)
+    try:
+        if not inspect(conn).has_table(FORECAST_TABLE):
+            return []
+        query = f"""
+            SELECT chave, date, type, revenue_real, revenue_forecast, revenue_lower, revenue_upper, modelo
+            FROM {FORECAST_TABLE}
+            WHERE dimensao = :dimension AND granularidade = :granularity AND fonte = :source
+        """
+        params = {"dimension": dimension, "granularity": granularity, "source": source}
+        if key:
+            query += " AND chave = :key"
+            params['key'] = key
+        query += " ORDER BY chave, date"
+        df = pd.read_sql_query(query, conn, params=params)
+    finally:
+        conn.close()
+
+    df = df.astype(object).where(df.notna(), None)
+    return df.to_dict(orient='records')
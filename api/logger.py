@@ -1,15 +1,75 @@
 import logging
 import sys
 import os
-from logging.handlers import RotatingFileHandler
+import json
+import queue
+import random
+import atexit
+import contextvars
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+
+# Request-ID da requisição corrente (preenchido pelo middleware em main.py)
+request_id_var = contextvars.ContextVar('request_id', default='-')
+
+# Amostragem das linhas INFO por requisição (alto volume). Só entram na amostragem os
+# records marcados com extra=SAMPLED (ex.: logger.info(msg, extra=SAMPLED)); resumos de
+# lote/pós-ETL e WARNING+ são sempre mantidos.
+SAMPLE_RATE = float(os.environ.get('API_LOG_SAMPLE_RATE', '0.1'))
+SAMPLED = {"sampled": True}
+CONSOLE_FORMAT = '%(asctime)s [%(levelname)s] %(name)s [%(request_id)s]: %(message)s'
+
+_listener = None
+
+
+class RequestIdFilter(logging.Filter):
+    """Anexa o request_id do contexto atual ao record (roda na thread da requisição)."""
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Descarta uma fração das linhas INFO/DEBUG marcadas como por requisição (extra=SAMPLED)."""
+    def __init__(self, rate=SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.rate >= 1.0:
+            return True
+        if not getattr(record, 'sampled', False):
+            return True
+        return random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    """Serializa cada record como uma linha JSON."""
+    def format(self, record):
+        payload = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, 'request_id', '-'),
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False)
+
 
 def setup_logging():
     """
-    Configura o sistema de log da aplicação.
-    - Console: Nível INFO (stdout)
-    - Arquivo: Nível INFO (api.log), rotativo (5MB x 3 arquivos)
+    Configura o sistema de log da aplicação (não bloqueante).
+    - Requisições só enfileiram o record (QueueHandler); a escrita ocorre
+      numa thread dedicada (QueueListener).
+    - Console: Nível INFO (stdout), texto com request_id
+    - Arquivo: Nível INFO (api.log), JSON por linha, rotativo (5MB x 3 arquivos)
+    Idempotente: chamadas repetidas não recriam o listener.
     """
-    
+    global _listener
+    if _listener is not None:
+        return
+
     # Nome do arquivo de log na raiz do projeto ou pasta api
     log_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api.log')
     log_file_path = os.path.normpath(log_file_path)
@@ -17,33 +77,68 @@ def setup_logging():
     # Root Logger
     logger = logging.getLogger()
     logger.setLevel(logging.INFO)
-    
-    # Evita duplicidade de handlers se a função for chamada 2x
+
+    # Evita duplicidade de handlers
     if logger.hasHandlers():
         logger.handlers.clear()
 
-    # Formatter
-    formatter = logging.Formatter('%(asctime)s [%(levelname)s] %(name)s: %(message)s')
+    handlers = []
 
     # 1. Console Handler (Stream)
     console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setFormatter(formatter)
+    console_handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
     console_handler.setLevel(logging.INFO)
-    logger.addHandler(console_handler)
+    handlers.append(console_handler)
 
-    # 2. File Handler (Rotating)
+    # 2. File Handler (Rotating, JSON)
     try:
         file_handler = RotatingFileHandler(log_file_path, maxBytes=5*1024*1024, backupCount=3, encoding='utf-8')
-        file_handler.setFormatter(formatter)
+        file_handler.setFormatter(JsonFormatter())
         file_handler.setLevel(logging.INFO)
-        logger.addHandler(file_handler)
+        handlers.append(file_handler)
     except Exception as e:
         print(f"Erro ao criar arquivo de log: {e}")
 
+    # 3. Fila: filtros rodam na thread chamadora (request_id do contexto correto)
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter())
+    queue_handler.addFilter(RequestIdFilter())
+    logger.addHandler(queue_handler)
+
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
     # Silencia loggers muito verbosos de terceiros se necessário
     logging.getLogger("multipart").setLevel(logging.WARNING)
-    
+
     logger.info(f"Logging configurado via api/logger.py. Arquivo: {log_file_path}")
 
-# Executa setup ao importar (opcional, ou chamar no main)
-setup_logging()
+
+def setup_worker_logging():
+    """
+    Initializer dos processos do pool (api.parallel): o QueueHandler herdado do pai
+    enfileiraria numa fila que ninguém drena neste processo. Troca por um handler de
+    console direto (sem arquivo: vários processos no mesmo RotatingFileHandler corrompem a rotação).
+    """
+    global _listener
+    _listener = None  # a thread do listener pertence ao processo pai
+
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+    logger.handlers.clear()
+
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+    handler.addFilter(SamplingFilter())
+    handler.addFilter(RequestIdFilter())
+    logger.addHandler(handler)
+
+
+def shutdown_logging():
+    """Esvazia a fila e encerra a thread de escrita."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
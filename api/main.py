@@ -1,9 +1,10 @@
-from fastapi import FastAPI
+import uuid
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from .logger import setup_logging
+from .logger import setup_logging, shutdown_logging, request_id_var
 from .routes import router
 
-# Inicializa logs
+# Inicializa logs (única chamada; o módulo logger não configura mais no import)
 setup_logging()
 
 app = FastAPI(
@@ -21,6 +22,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Correlação de logs: propaga/gera X-Request-ID por requisição
+@app.middleware("http")
+async def request_id_middleware(request: Request, call_next):
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex[:12]
+    token = request_id_var.set(request_id)
+    try:
+        response = await call_next(request)
+    finally:
+        request_id_var.reset(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+@app.on_event("shutdown")
+def flush_logs():
+    shutdown_logging()
+
 # Inclui as rotas
 app.include_router(router, prefix="/api")
 
@@ -0,0 +1,23 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from .logger import setup_worker_logging
+
+logger = logging.getLogger(__name__)
+
+
+def run_in_pool(task, args_list, max_workers=None):
+    """
+    Executa task(args) para cada item num ProcessPoolExecutor.
+    Com poucas tarefas o custo de subir o pool não compensa, então roda sequencial.
+    Os workers recebem um handler de log próprio (setup_worker_logging).
+    """
+    if len(args_list) <= 2 or max_workers == 1:
+        return [task(a) for a in args_list]
+
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=setup_worker_logging) as executor:
+            return list(executor.map(task, args_list, chunksize=max(1, len(args_list) // 32)))
+    except Exception as e:
+        logger.warning(f"Pool de processos indisponível ({e}). Rodando sequencial.")
+        return [task(a) for a in args_list]
+
@@ -0,0 +1,185 @@
+import pandas as pd
+import numpy as np
+import scipy.sparse as sp
+import logging
+from .forecast import _get_config, forecast_dates, _fit_predict_task, BATCH_WORKERS
+from .parallel import run_in_pool
+from .cache import make_key, cache_get, cache_set
+from .series_store import bucket_expression
+
+# Configuração de Logger
+logger = logging.getLogger(__name__)
+
+RECONCILIATION_METHODS = ('bottom_up', 'ols', 'mint')
+OTHERS_LABEL = 'Outros'
+
+
+def load_hierarchy(company='animoshop', granularity='weekly', source='limpas', top_n=10):
+    """
+    Lê numa única query o faturamento por (semana/mês, marketplace, produto) e monta as folhas
+    da hierarquia Total > Marketplace > Produto. Por marketplace ficam os top_n produtos;
+    o restante vira a folha 'Outros' (mantém a soma igual ao total).
+
+    Retorna (datas, Y_folhas [T x N], DataFrame das folhas [marketplace, produto]) ou None.
+    """
+    from .routes import get_filtered_query
+
+    base_query, params, conn = get_filtered_query(company, source=source)
+    if not base_query: return None
+
+    rule = _get_config(granularity)['resample_rule']
+    bucket = bucket_expression(rule) or 'data_filtro'
+    query = f"""
+        SELECT {bucket} as data_filtro, marketplace, produto, SUM(faturamento) as faturamento
+        FROM ({base_query})
+        WHERE faturamento > 0 AND data_filtro IS NOT NULL AND marketplace IS NOT NULL AND marketplace != ''
+        GROUP BY 1, marketplace, produto
+    """
+    df = pd.read_sql_query(query, conn, params=params)
+    conn.close()
+    if df.empty: return None
+
+    # Top-N produtos por marketplace (rank vetorizado); demais -> 'Outros'
+    totals = df.groupby(['marketplace', 'produto'], as_index=False)['faturamento'].sum()
+    totals['rank'] = totals.groupby('marketplace')['faturamento'].rank(method='first', ascending=False)
+    keep = totals.loc[totals['rank'] <= top_n, ['marketplace', 'produto']]
+    keep['manter'] = True
+    df = df.merge(keep, on=['marketplace', 'produto'], how='left')
+    df.loc[df['manter'].isna(), 'produto'] = OTHERS_LABEL
+
+    df['data_filtro'] = pd.to_datetime(df['data_filtro'])
+    wide = df.pivot_table(index='data_filtro', columns=['marketplace', 'produto'], values='faturamento', aggfunc='sum')
+    wide = wide.resample(rule).sum().fillna(0)
+
+    # Remove período pré-operacional do total
+    active = wide.sum(axis=1).gt(0).to_numpy()
+    if not active.any(): return None
+    wide = wide.iloc[int(active.argmax()):]
+
+    leaves = pd.DataFrame(list(wide.columns), columns=['marketplace', 'produto'])
+    return wide.index, wide.to_numpy(dtype=float), leaves
+
+
+def aggregation_matrix(leaf_marketplaces):
+    """
+    Parte agregada da matriz de soma S = [A; I] em formato esparso (CSR).
+    Linhas: Total, depois um marketplace por linha. Colunas: folhas.
+    """
+    mp_codes, mp_names = pd.factorize(pd.Series(leaf_marketplaces))
+    n_leaves = len(mp_codes)
+    total_row = sp.csr_matrix(np.ones((1, n_leaves)))
+    mp_rows = sp.csr_matrix(
+        (np.ones(n_leaves), (mp_codes, np.arange(n_leaves))),
+        shape=(len(mp_names), n_leaves)
+    )
+    return sp.vstack([total_row, mp_rows]).tocsr(), list(mp_names)
+
+
+def reconcile(base_forecasts, A, method='mint', variances=None):
+    """
+    Reconcilia previsões base [(k + N) x H] (agregados primeiro, depois folhas).
+
+    - bottom_up: usa só as folhas e agrega.
+    - ols: MinT com W = I.
+    - mint: MinT com W diagonal = variância dos resíduos de cada nó (MinT-WLS).
+
+    MinT: b = (S' W^-1 S)^-1 S' W^-1 y. Com S = [A; I] e W diagonal,
+    S' W^-1 S = D + A' C A (D, C diagonais), invertida via Woodbury: só um sistema
+    denso k x k (k = nº de agregados), nunca N x N.
+    Retorna (previsões coerentes [(k + N) x H], folhas [N x H]).
+    """
+    k = A.shape[0]
+    y_agg, y_leaf = base_forecasts[:k], base_forecasts[k:]
+
+    if method == 'bottom_up':
+        leaves = y_leaf
+    else:
+        if method == 'ols' or variances is None:
+            w = np.ones(base_forecasts.shape[0])
+        else:
+            w = np.maximum(np.asarray(variances, dtype=float), 1e-9)
+        w_agg, w_leaf = w[:k], w[k:]
+
+        rhs = A.T @ (y_agg / w_agg[:, None]) + y_leaf / w_leaf[:, None]
+        z = w_leaf[:, None] * rhs
+        inner = np.diag(w_agg) + (A.multiply(w_leaf[None, :]) @ A.T).toarray()
+        leaves = z - w_leaf[:, None] * (A.T @ np.linalg.solve(inner, A @ z))
+
+    # Receita não negativa: trunca nas folhas e re-agrega (continua coerente)
+    leaves = np.maximum(leaves, 0)
+    return np.vstack([A @ leaves, leaves]), leaves
+
+
+def generate_hierarchical_forecast(company='animoshop', periods_to_predict=12, granularity='weekly', method='mint', top_n=10, source='limpas'):
+    """
+    Forecast coerente em todos os níveis (Total, Marketplace, Marketplace x Produto).
+    As previsões base de cada nó são ajustadas em paralelo e depois reconciliadas.
+    Intervalo: 1.96 * StdDev(resíduos do nó) * sqrt(t) em torno do valor reconciliado.
+    """
+    if method not in RECONCILIATION_METHODS:
+        return {"status": "error", "message": f"Método inválido: {method}. Use {', '.join(RECONCILIATION_METHODS)}."}
+
+    key = make_key(company, granularity, source, periods_to_predict, method, top_n)
+    cached = cache_get('forecast_hierarchy', key)
+    if cached is not None:
+        return cached
+
+    hierarchy = load_hierarchy(company, granularity, source, top_n)
+    if hierarchy is None:
+        return {"status": "error", "message": "Sem dados."}
+    dates, y_leaves, leaves = hierarchy
+    if len(dates) < 4:
+        return {"status": "error", "message": f"Dados insuficientes ({len(dates)} obs, mínimo 4)."}
+
+    A, mp_names = aggregation_matrix(leaves['marketplace'].to_numpy())
+    k = A.shape[0]
+
+    # Séries de todos os nós: agregados (A @ Y') empilhados sobre as folhas
+    y_all = np.vstack([A @ y_leaves.T, y_leaves.T])
+    tasks = [(i, pd.Series(y_all[i], index=dates), granularity, periods_to_predict) for i in range(y_all.shape[0])]
+    results = sorted(run_in_pool(_fit_predict_task, tasks, BATCH_WORKERS), key=lambda r: r[0])
+
+    base = np.array([r[2] for r in results], dtype=float)
+    resid_std = np.array([r[3] for r in results], dtype=float)
+    models = [r[1] for r in results]
+
+    coherent, _ = reconcile(base, A, method, resid_std ** 2)
+
+    steps = np.arange(1, periods_to_predict + 1)
+    margin = 1.96 * resid_std[:, None] * np.sqrt(steps)[None, :]
+    lower = np.maximum(coherent - margin, 0)
+    upper = coherent + margin
+
+    future_dates = forecast_dates(dates[-1], periods_to_predict, granularity)
+
+    levels = (
+        [("total", None, None)]
+        + [("marketplace", mp, None) for mp in mp_names]
+        + [("produto", mp, prod) for mp, prod in zip(leaves['marketplace'], leaves['produto'])]
+    )
+    nodes = [
+        {
+            "level": level,
+            "marketplace": mp,
+            "produto": prod,
+            "model": models[i],
+            "base_forecast": np.round(base[i], 2).tolist(),
+            "forecast": np.round(coherent[i], 2).tolist(),
+            "lower": np.round(lower[i], 2).tolist(),
+            "upper": np.round(upper[i], 2).tolist(),
+        }
+        for i, (level, mp, prod) in enumerate(levels)
+    ]
+
+    result = {
+        "status": "success",
+        "method": method,
+        "granularity": granularity,
+        "dates": future_dates.strftime("%Y-%m-%d").tolist(),
+        "n_leaves": int(y_leaves.shape[1]),
+        "n_aggregates": int(k),
+        "nodes": nodes,
+    }
+    logger.info(f"Forecast hierárquico {granularity} ({method}): {k} agregados, {y_leaves.shape[1]} folhas.")
+    cache_set('forecast_hierarchy', key, result)
+    return result
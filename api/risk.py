@@ -1,9 +1,34 @@
 import pandas as pd
+import numpy as np
 import logging
-from .database import get_db_connection
+from .series_store import bucket_expression
 
 logger = logging.getLogger(__name__)
 
+# Faixas do HHI (DoJ/CADE): (limite superior, nível, descrição, cor)
+HHI_LEVELS = [
+    (1500, "Baixo", "Portfólio diversificado. Baixo risco estrutural.", "green"),
+    (2500, "Moderado", "Concentração moderada. Atenção recomendada.", "yellow"),
+    (float('inf'), "Alto", "Alta concentração. Vulnerabilidade crítica a bloqueios.", "red"),
+]
+SERIES_RULES = {'weekly': 'W-MON', 'monthly': 'ME'}
+
+# Monte Carlo de bloqueio de canal: duração (dias) e taxa de migração da receita
+# perdida para os outros canais são sorteadas por simulação.
+MC_SIMULATIONS = 20000
+MC_OUTAGE_DAYS = (3, 30)
+MC_SHIFT_RATE = (0.0, 0.5)
+MC_LOOKBACK_DAYS = 180
+MC_MAX_SIMULATIONS = 200000
+# Limita a matriz [simulações x dias] (até 200k x 90 por endpoint público)
+MC_MAX_OUTAGE_DAYS = 90
+
+
+def classify_hhi(hhi):
+    """Índice da faixa de risco (vetorizado): < 1500 Baixo, <= 2500 Moderado, > 2500 Alto."""
+    hhi = np.asarray(hhi, dtype=float)
+    return np.where(hhi < HHI_LEVELS[0][0], 0, np.where(hhi <= HHI_LEVELS[1][0], 1, 2))
+
 def calculate_market_risk(company='animoshop', start_date=None, end_date=None, source=None, marketplace=None):
     """
     Calcula o Risco de Concentração de Mercado (HHI) e Simulação de Impacto.
@@ -29,14 +54,10 @@ def calculate_market_risk(company='animoshop', start_date=None, end_date=None, s
         # Para ser mais útil "Anualmente", vamos forçar um filtro de 1 ano atrás?
         # O prompt diz "Busque o faturamento total...". Vamos usar o total disponível.
         
-        base_query, params, _ = get_filtered_query(company, start_date, end_date, source, marketplace)
-        conn = get_db_connection(company)
-        
+        base_query, params, conn = get_filtered_query(company, start_date, end_date, source, marketplace)
         if not base_query:
-            conn.close()
             return {"status": "error", "message": "Sem dados."}
             
-        params['company'] = company
         query = f"""
             SELECT marketplace, SUM(faturamento) as revenue
             FROM ({base_query})
@@ -53,38 +74,19 @@ def calculate_market_risk(company='animoshop', start_date=None, end_date=None, s
             
         # 2. Métricas Básicas
         total_revenue = df['revenue'].sum()
-        hhi_score = 0
-        distribution = []
-        
         df['share'] = df['revenue'] / total_revenue
         df['share_pct'] = df['share'] * 100
         
-        # 3. Cálculo HHI
-        for _, row in df.iterrows():
-            s_pct = row['share_pct']
-            hhi_score += s_pct ** 2
-            
-            distribution.append({
-                "marketplace": row['marketplace'],
-                "revenue": float(row['revenue']),
-                "share_percentage": round(s_pct, 2)
-            })
+        # 3. Cálculo HHI (vetorizado)
+        hhi_score = round(float((df['share_pct'] ** 2).sum()), 0)
+        distribution = pd.DataFrame({
+            "marketplace": df['marketplace'],
+            "revenue": df['revenue'].astype(float),
+            "share_percentage": df['share_pct'].round(2),
+        }).to_dict(orient='records')
             
         # 4. Classificação de Risco (DoJ/CADE)
-        hhi_score = round(hhi_score, 0)
-        
-        if hhi_score < 1500:
-            risk_level = "Baixo"
-            risk_desc = "Portfólio diversificado. Baixo risco estrutural."
-            color = "green"
-        elif hhi_score <= 2500:
-            risk_level = "Moderado"
-            risk_desc = "Concentração moderada. Atenção recomendada."
-            color = "yellow"
-        else:
-            risk_level = "Alto"
-            risk_desc = "Alta concentração. Vulnerabilidade crítica a bloqueios."
-            color = "red"
+        _, risk_level, risk_desc, color = HHI_LEVELS[int(classify_hhi(hhi_score))]
             
         # 5. Simulação "O Que Acontece Se..." (Impacto do Líder)
         dominant = df.iloc[0]
@@ -119,3 +121,180 @@ def calculate_market_risk(company='animoshop', start_date=None, end_date=None, s
     except Exception as e:
         logger.error(f"Erro em calculate_market_risk: {e}")
         return {"status": "error", "message": str(e)}
+
+
+def calculate_hhi_series(company='animoshop', granularity='monthly', window=1, start_date=None, end_date=None, source=None, marketplace=None):
+    """
+    Série do HHI por semana/mês numa única passada agrupada (bucket x marketplace) no SQL.
+    window > 1: HHI móvel sobre a receita acumulada dos últimos `window` períodos.
+    """
+    from .routes import get_filtered_query
+
+    rule = SERIES_RULES.get(granularity)
+    if rule is None:
+        return {"status": "error", "message": f"Granularidade inválida: {granularity}. Use {', '.join(SERIES_RULES)}."}
+    window = max(int(window or 1), 1)
+
+    base_query, params, conn = get_filtered_query(company, start_date, end_date, source, marketplace)
+    if not base_query:
+        return {"status": "error", "message": "Sem dados."}
+    try:
+        query = f"""
+            SELECT {bucket_expression(rule)} as periodo, marketplace, SUM(faturamento) as revenue
+            FROM ({base_query})
+            WHERE faturamento > 0 AND data_filtro IS NOT NULL
+            GROUP BY periodo, marketplace
+        """
+        df = pd.read_sql_query(query, conn, params=params)
+    finally:
+        conn.close()
+
+    df = df[df['periodo'].notna()]
+    if df.empty:
+        return {"status": "error", "message": "Sem faturamento registrado."}
+
+    # Matriz período x marketplace (buracos = 0), janela móvel e shares em bloco
+    df['periodo'] = pd.to_datetime(df['periodo'])
+    wide = df.pivot_table(index='periodo', columns='marketplace', values='revenue', aggfunc='sum')
+    wide = wide.resample(rule).sum().fillna(0)
+    if window > 1:
+        wide = wide.rolling(window, min_periods=1).sum()
+
+    revenue = wide.to_numpy(dtype=float)
+    total = revenue.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        share_pct = np.where(total[:, None] > 0, revenue / total[:, None] * 100, 0.0)
+    hhi = np.round((share_pct ** 2).sum(axis=1), 0)
+    level = classify_hhi(hhi)
+    dominant = share_pct.argmax(axis=1)
+
+    names = np.array([lv[1] for lv in HHI_LEVELS], dtype=object)
+    colors = np.array([lv[3] for lv in HHI_LEVELS], dtype=object)
+    marketplaces = np.array(wide.columns, dtype=object)
+    series = pd.DataFrame({
+        "date": wide.index.strftime('%Y-%m-%d'),
+        "hhi_score": hhi,
+        "risk_level": names[level],
+        "risk_color": colors[level],
+        "total_revenue": np.round(total, 2),
+        "dominant_marketplace": marketplaces[dominant],
+        "dominant_share": np.round(share_pct[np.arange(len(share_pct)), dominant], 2),
+    })
+    # Períodos sem venda não têm concentração definida
+    series = series[total > 0]
+
+    return {
+        "status": "success",
+        "company": company,
+        "granularity": granularity,
+        "window": window,
+        "series": series.to_dict(orient='records'),
+    }
+
+
+def load_daily_revenue(company='animoshop', start_date=None, end_date=None, source=None, lookback_days=MC_LOOKBACK_DAYS):
+    """Receita diária por marketplace (dias x marketplaces, dias sem venda = 0) dos últimos lookback_days."""
+    from .routes import get_filtered_query
+
+    base_query, params, conn = get_filtered_query(company, start_date, end_date, source)
+    if not base_query:
+        return None
+    try:
+        query = f"""
+            SELECT date(data_filtro) as dia_venda, marketplace, SUM(faturamento) as revenue
+            FROM ({base_query})
+            WHERE faturamento > 0 AND data_filtro IS NOT NULL
+            GROUP BY dia_venda, marketplace
+        """
+        # Alias != 'dia': no GROUP BY o SQLite resolveria 'dia' para a coluna da base (dia do mês)
+        df = pd.read_sql_query(query, conn, params=params)
+    finally:
+        conn.close()
+
+    df = df[df['dia_venda'].notna()]
+    if df.empty:
+        return None
+    df['dia_venda'] = pd.to_datetime(df['dia_venda'])
+    daily = df.pivot_table(index='dia_venda', columns='marketplace', values='revenue', aggfunc='sum')
+    daily = daily.resample('D').sum().fillna(0)
+    if lookback_days:
+        daily = daily[daily.index > daily.index[-1] - pd.Timedelta(days=lookback_days)]
+    return daily
+
+
+def simulate_outages(daily, n_simulations=MC_SIMULATIONS, outage_days=MC_OUTAGE_DAYS, shift_rate=MC_SHIFT_RATE, seed=None):
+    """
+    Para cada marketplace (cenário = bloqueio dele), em n_simulations sorteios:
+    - duração D ~ Uniforme inteira [min, max] dias;
+    - receita dos D dias por bootstrap dos dias históricos do canal;
+    - taxa de migração r ~ Uniforme [min, max] (parte da perda recuperada nos outros canais).
+    Perda líquida = perda bruta * (1 - r). Tudo em matrizes [simulações x dias], sem loops
+    por simulação. seed fixa torna o resultado reprodutível.
+    """
+    rng = np.random.default_rng(seed)
+    min_days, max_days = int(outage_days[0]), int(outage_days[1])
+    revenue = daily.to_numpy(dtype=float)                 # [dias x marketplaces]
+    n_hist = revenue.shape[0]
+
+    # Sorteios compartilhados entre cenários (variáveis comuns -> comparação mais estável)
+    duration = rng.integers(min_days, max_days + 1, n_simulations)
+    day_idx = rng.integers(0, n_hist, (n_simulations, max_days), dtype=np.int32)
+    active = np.arange(max_days)[None, :] < duration[:, None]
+    shift = rng.uniform(shift_rate[0], shift_rate[1], n_simulations)
+    total_daily = revenue.sum(axis=1)
+    # Receita total do período (igual em todos os cenários): um único gather
+    baseline = (total_daily[day_idx] * active).sum(axis=1)
+
+    scenarios = []
+    for j, marketplace in enumerate(daily.columns):
+        gross = (revenue[day_idx, j] * active).sum(axis=1)
+        net = gross * (1 - shift)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            net_pct = np.where(baseline > 0, net / baseline * 100, 0.0)
+        p50, p95 = np.percentile(net, [50, 95])
+        scenarios.append({
+            "marketplace": marketplace,
+            "gross_loss_p50": round(float(np.percentile(gross, 50)), 2),
+            "gross_loss_p95": round(float(np.percentile(gross, 95)), 2),
+            "net_loss_mean": round(float(net.mean()), 2),
+            "net_loss_p50": round(float(p50), 2),
+            "net_loss_p95": round(float(p95), 2),
+            "net_loss_pct_p50": round(float(np.percentile(net_pct, 50)), 2),
+            "net_loss_pct_p95": round(float(np.percentile(net_pct, 95)), 2),
+        })
+    scenarios.sort(key=lambda sc: sc['net_loss_p95'], reverse=True)
+    return scenarios
+
+
+def calculate_outage_simulation(company='animoshop', n_simulations=MC_SIMULATIONS, min_days=MC_OUTAGE_DAYS[0], max_days=MC_OUTAGE_DAYS[1],
+                                shift_min=MC_SHIFT_RATE[0], shift_max=MC_SHIFT_RATE[1], seed=None, start_date=None, end_date=None, source=None):
+    """Monte Carlo de bloqueio por marketplace: distribuição de perda (P50/P95) por cenário."""
+    if not (1 <= min_days <= max_days):
+        return {"status": "error", "message": "Duração inválida: use 1 <= min_days <= max_days."}
+    if max_days > MC_MAX_OUTAGE_DAYS:
+        return {"status": "error", "message": f"Duração inválida: max_days deve ser <= {MC_MAX_OUTAGE_DAYS}."}
+    if not (0 <= shift_min <= shift_max <= 1):
+        return {"status": "error", "message": "Taxa de migração inválida: use 0 <= shift_min <= shift_max <= 1."}
+    n_simulations = int(min(max(n_simulations, 100), MC_MAX_SIMULATIONS))
+
+    daily = load_daily_revenue(company, start_date, end_date, source)
+    if daily is None or daily.empty:
+        return {"status": "error", "message": "Sem faturamento registrado."}
+
+    t0 = pd.Timestamp.now()
+    scenarios = simulate_outages(daily, n_simulations, (min_days, max_days), (shift_min, shift_max), seed)
+    elapsed = (pd.Timestamp.now() - t0).total_seconds()
+    logger.info(f"Monte Carlo de bloqueio {company}: {n_simulations} simulações x {len(scenarios)} cenários em {elapsed:.3f}s")
+
+    return {
+        "status": "success",
+        "company": company,
+        "parameters": {
+            "n_simulations": n_simulations,
+            "outage_days": [min_days, max_days],
+            "shift_rate": [shift_min, shift_max],
+            "history_days": int(len(daily)),
+            "seed": seed,
+        },
+        "scenarios": scenarios,
+    }
@@ -1,10 +1,13 @@
 from fastapi import APIRouter, HTTPException, BackgroundTasks
 from .database import get_db_connection
-from .forecast import generate_forecast
-from .clustering import perform_clustering
-from .elasticity import calculate_elasticity
-from .bundles import calculate_bundles
-from .risk import calculate_market_risk
+from .forecast import generate_forecast, get_model, run_forecast_batch, get_forecast_by_dimension, DIMENSION_COLUMNS
+from .reconciliation import generate_hierarchical_forecast
+from .clustering import perform_clustering, get_clustering
+from .elasticity import calculate_elasticity, run_elasticity_batch, get_elasticity_ranking, precompute_elasticity
+from .cross_elasticity import run_cross_elasticity, get_cross_elasticity
+from .bundles import get_bundles, get_recommendations, build_rule_store
+from .risk import calculate_market_risk, calculate_hhi_series, calculate_outage_simulation
+from .cache import invalidate
 import pandas as pd
 import threading
 import time
@@ -406,44 +409,85 @@ def get_sales_forecast(periods: int = 12, granularity: str = 'weekly', company:
         traceback.print_exc()
         return [{"error": str(e), "trace": traceback.format_exc()}]
 
+@router.get("/forecast/hierarchical")
+def get_hierarchical_forecast(periods: int = 12, granularity: str = 'weekly', method: str = 'mint', top_n: int = 10, company: str = 'animoshop'):
+    try:
+        return generate_hierarchical_forecast(company, periods, granularity, method, top_n)
+    except Exception as e:
+        logger.exception("Erro forecast hierárquico")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/forecast/batch")
+def trigger_forecast_batch(background_tasks: BackgroundTasks, granularity: str = 'weekly', periods: int = 12, top_n_products: int = None, company: str = 'animoshop'):
+    background_tasks.add_task(run_forecast_batch, company, granularity, periods, 'limpas', top_n_products)
+    return {"message": f"Forecast em lote iniciado para {company} ({granularity})."}
+
+@router.get("/forecast/by-dimension")
+def get_dimension_forecast(dimension: str = 'marketplace', key: str = None, granularity: str = 'weekly', company: str = 'animoshop'):
+    if dimension not in DIMENSION_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"Dimensão inválida: {dimension}")
+    try:
+        return get_forecast_by_dimension(company, dimension, key, granularity)
+    except Exception as e:
+        logger.error(f"Erro forecast por dimensão: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/analysis/clustering")
-def get_product_clustering(start_date: str = None, end_date: str = None, source: str = None, marketplace: str = None, company: str = 'animoshop'):
+def get_product_clustering(start_date: str = None, end_date: str = None, source: str = None, marketplace: str = None, company: str = 'animoshop', auto_k: bool = False, metric: str = 'silhouette', features: str = 'basic'):
     try:
-        base_query, params, conn = get_filtered_query(company, start_date, end_date, source, marketplace)
-        if not base_query: return []
-        
-        query = f"""
-            SELECT 
-                produto,
-                SUM(faturamento) as faturamento,
-                SUM(lucro_bruto) as lucro,
-                SUM(contagem_pedidos) as quantidade
-            FROM ({base_query})
-            GROUP BY produto
-        """
-        df = pd.read_sql_query(query, conn, params=params)
-        conn.close()
-        
-        from .clustering import perform_clustering_from_df
-        return perform_clustering_from_df(df)
-        
+        return get_clustering(company, start_date, end_date, source, marketplace, auto_k, metric, features)
     except Exception as e:
         logger.error(f"Erro clustering: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/analysis/bundles")
-def get_bundle_suggestions(min_lift: float = 1.1, min_confidence: float = 0.3, company: str = 'animoshop'):
+def get_bundle_suggestions(min_lift: float = 1.1, min_confidence: float = 0.3, max_len: int = None, start_date: str = None, end_date: str = None, source: str = None, marketplace: str = None, by_marketplace: bool = False, company: str = 'animoshop'):
     try:
-        results = calculate_bundles(company, min_lift, min_confidence)
+        results = get_bundles(company, min_lift, min_confidence, max_len=max_len, start_date=start_date, end_date=end_date,
+                              source=source, marketplace=marketplace, by_marketplace=by_marketplace)
         return results
     except Exception as e:
         logger.exception("Erro em bundles")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/analysis/bundles/recommendations")
+def get_product_recommendations(product_name: str, limit: int = 10, min_lift: float = 1.0, min_confidence: float = 0.0, company: str = 'animoshop'):
+    try:
+        return get_recommendations(product_name, company, limit, min_lift, min_confidence)
+    except Exception as e:
+        logger.exception("Erro em recomendações")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/analysis/elasticity")
 def get_price_elasticity(product_name: str, start_date: str = None, end_date: str = None, source: str = None, marketplace: str = None, company: str = 'animoshop'):
     return calculate_elasticity(product_name, company, start_date, end_date, source, marketplace)
 
+@router.post("/analysis/elasticity/batch")
+def trigger_elasticity_batch(background_tasks: BackgroundTasks, start_date: str = None, end_date: str = None, marketplace: str = None, company: str = 'animoshop'):
+    background_tasks.add_task(run_elasticity_batch, company, start_date, end_date, 'limpas', marketplace)
+    return {"message": f"Elasticidade em lote iniciada para {company}."}
+
+@router.get("/analysis/elasticity/ranking")
+def get_elasticity_ranking_endpoint(start_date: str = None, end_date: str = None, marketplace: str = None, min_r2: float = 0.0, limit: int = None, company: str = 'animoshop'):
+    try:
+        return get_elasticity_ranking(company, 'limpas', marketplace, start_date, end_date, min_r2, limit)
+    except Exception as e:
+        logger.error(f"Erro ranking elasticidade: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/analysis/cross-elasticity")
+def trigger_cross_elasticity(background_tasks: BackgroundTasks, top_n: int = 20, marketplace: str = None, company: str = 'animoshop'):
+    background_tasks.add_task(run_cross_elasticity, company, top_n, 'limpas', marketplace)
+    return {"message": f"Elasticidade cruzada iniciada para {company} (top {top_n})."}
+
+@router.get("/analysis/cross-elasticity")
+def get_cross_price_elasticity(product_name: str = None, relation: str = None, marketplace: str = None, company: str = 'animoshop'):
+    try:
+        return get_cross_elasticity(company, product_name, relation, 'limpas', marketplace)
+    except Exception as e:
+        logger.error(f"Erro elasticidade cruzada: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/analysis/risk-analysis")
 def get_risk_analysis(start_date: str = None, end_date: str = None, source: str = None, marketplace: str = None, company: str = 'animoshop'):
     try:
@@ -452,6 +496,22 @@ def get_risk_analysis(start_date: str = None, end_date: str = None, source: str
         logger.error(f"Erro risk-analysis: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/analysis/risk-analysis/series")
+def get_risk_series(granularity: str = 'monthly', window: int = 1, start_date: str = None, end_date: str = None, source: str = None, marketplace: str = None, company: str = 'animoshop'):
+    try:
+        return calculate_hhi_series(company, granularity, window, start_date, end_date, source, marketplace)
+    except Exception as e:
+        logger.error(f"Erro risk-analysis série: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/analysis/risk-analysis/simulation")
+def get_outage_simulation(n_simulations: int = 20000, min_days: int = 3, max_days: int = 30, shift_min: float = 0.0, shift_max: float = 0.5, seed: int = None, start_date: str = None, end_date: str = None, source: str = None, company: str = 'animoshop'):
+    try:
+        return calculate_outage_simulation(company, n_simulations, min_days, max_days, shift_min, shift_max, seed, start_date, end_date, source)
+    except Exception as e:
+        logger.error(f"Erro simulação de bloqueio: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 # --- ETL ---
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -466,9 +526,29 @@ def run_etl_process(company='animoshop'):
         else:
             return
         etl.main()
+        # Libera caches de modelos/resultados da carga anterior (a versão dos dados já mudou)
+        invalidate(company)
         logger.info(f"ETL finalizado com sucesso ({company}).")
     except Exception as e:
         logger.exception(f"Erro crítico no ETL ({company})")
+        return
+    run_post_etl_jobs(company)
+
+def run_post_etl_jobs(company='animoshop'):
+    """Etapas pós-ETL (pré-cálculos sobre a nova carga). Falhas não derrubam as demais."""
+    jobs = [
+        ("seleção/ajuste de modelo (semanal)", lambda: get_model(company, 'weekly')),
+        ("seleção/ajuste de modelo (mensal)", lambda: get_model(company, 'monthly')),
+        ("forecast em lote (semanal)", lambda: run_forecast_batch(company, 'weekly')),
+        ("forecast em lote (mensal)", lambda: run_forecast_batch(company, 'monthly')),
+        ("elasticidade por produto", lambda: precompute_elasticity(company)),
+        ("regras de associação", lambda: build_rule_store(company)),
+    ]
+    for name, job in jobs:
+        try:
+            job()
+        except Exception:
+            logger.exception(f"Erro no pós-ETL: {name} ({company})")
 
 @router.post("/processar")
 def trigger_etl(background_tasks: BackgroundTasks, company: str = 'animoshop'):
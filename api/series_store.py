@@ -0,0 +1,180 @@
+import json
+import logging
+import pandas as pd
+from sqlalchemy import inspect, text
+from .database import get_db_engine
+
+logger = logging.getLogger(__name__)
+
+# Séries reamostradas persistidas no próprio banco da empresa.
+# Após o ETL só os últimos buckets são relidos e regravados (janela de sobreposição);
+# o restante é validado por uma única soma em SQL e reaproveitado.
+SERIES_TABLE = 'forecast_serie'
+STATE_TABLE = 'forecast_estado'
+OVERLAP_BUCKETS = {'weekly': 4, 'monthly': 2}
+FAR_FUTURE = '9999-12-31'
+
+
+# Rótulo do bucket calculado no SQLite, idêntico ao do pandas:
+# W-MON -> segunda-feira no/após o dia; ME -> último dia do mês.
+BUCKET_SQL = {
+    'W-MON': "date(data_filtro, 'weekday 1')",
+    'ME': "date(data_filtro, 'start of month', '+1 month', '-1 day')",
+}
+
+
+def bucket_expression(rule):
+    """Expressão SQL do bucket da regra de resample (None se não suportada)."""
+    return BUCKET_SQL.get(rule)
+
+
+def _read_raw(company, source, rule, start_date=None, end_date=None):
+    """
+    Faturamento (> 0) no intervalo, já agregado por bucket no SQL
+    (uma linha por semana/mês em vez de uma por venda). Buracos viram 0.
+    """
+    from .routes import get_filtered_query
+
+    base_query, params, conn = get_filtered_query(company, start_date, end_date, source)
+    if not base_query: return None
+
+    bucket = bucket_expression(rule)
+    if bucket:
+        query = f"""
+            SELECT {bucket} as bucket, SUM(faturamento) as faturamento
+            FROM ({base_query})
+            WHERE faturamento > 0 AND data_filtro IS NOT NULL
+            GROUP BY bucket
+        """
+    else:
+        query = f"SELECT data_filtro as bucket, faturamento FROM ({base_query}) WHERE faturamento > 0"
+    df = pd.read_sql_query(query, conn, params=params)
+    conn.close()
+
+    df = df[df['bucket'].notna()]
+    if df.empty: return pd.Series(dtype=float)
+
+    grouped = pd.Series(df['faturamento'].to_numpy(dtype=float), index=pd.to_datetime(df['bucket']))
+    return grouped.resample(rule).sum().fillna(0)
+
+
+def _stable_total(company, source, end_date):
+    """Soma do faturamento (> 0) até end_date, calculada no SQL (guarda contra mudanças antigas)."""
+    from .routes import get_filtered_query
+
+    base_query, params, conn = get_filtered_query(company, '0000-01-01', end_date, source)
+    if not base_query: return None
+    total = pd.read_sql_query(f"SELECT SUM(faturamento) as total FROM ({base_query}) WHERE faturamento > 0", conn, params=params)
+    conn.close()
+    return float(total['total'].iloc[0] or 0.0)
+
+
+def _read_persisted(engine, granularity, source):
+    if not inspect(engine).has_table(SERIES_TABLE):
+        return None
+    df = pd.read_sql_query(
+        text(f"SELECT data, faturamento FROM {SERIES_TABLE} WHERE granularidade = :g AND fonte = :f ORDER BY data"),
+        engine, params={"g": granularity, "f": source}
+    )
+    if df.empty:
+        return None
+    return pd.Series(df['faturamento'].to_numpy(dtype=float), index=pd.to_datetime(df['data']))
+
+
+def _write_persisted(engine, granularity, source, series, replace_after=None):
+    """Regrava a série inteira (replace_after=None) ou só os buckets > replace_after."""
+    tail = series if replace_after is None else series[series.index > replace_after]
+    df = pd.DataFrame({
+        "granularidade": granularity,
+        "fonte": source,
+        "data": tail.index.strftime('%Y-%m-%d'),
+        "faturamento": tail.to_numpy(dtype=float),
+    })
+    with engine.begin() as conn:
+        if inspect(conn).has_table(SERIES_TABLE):
+            query = f"DELETE FROM {SERIES_TABLE} WHERE granularidade = :g AND fonte = :f"
+            params = {"g": granularity, "f": source}
+            if replace_after is not None:
+                query += " AND data > :d"
+                params['d'] = replace_after.strftime('%Y-%m-%d')
+            conn.execute(text(query), params)
+        df.to_sql(SERIES_TABLE, conn, if_exists='append', index=False)
+        conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS idx_{SERIES_TABLE}_lookup ON {SERIES_TABLE} (granularidade, fonte, data)"
+        ))
+
+
+def refresh_series(company='animoshop', granularity='weekly', source='limpas', rule='W-MON', full=False):
+    """
+    Devolve a série reamostrada atualizando só o delta.
+
+    1. Lê a série persistida; mantém como estável tudo até os últimos N buckets.
+    2. Confere no SQL se a soma até o fim da parte estável não mudou
+       (se mudou -> reconstrução completa).
+    3. Relê e reamostra apenas as linhas após a parte estável e regrava esses buckets.
+
+    Retorna (série, info) — info = {"mode": "full" | "incremental", "buckets": regravados}.
+    """
+    engine = get_db_engine(company)
+    try:
+        persisted = None if full else _read_persisted(engine, granularity, source)
+        overlap = OVERLAP_BUCKETS.get(granularity, 4)
+
+        if persisted is not None and len(persisted) > overlap:
+            stable = persisted.iloc[:-overlap]
+            stable_end = stable.index[-1]
+            current_total = _stable_total(company, source, f"{stable_end:%Y-%m-%d} 23:59:59")
+
+            if current_total is not None and abs(current_total - stable.sum()) <= 0.01 + 1e-9 * abs(current_total):
+                start = (stable_end + pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+                delta = _read_raw(company, source, rule, start, FAR_FUTURE)
+                if delta is not None:
+                    series = pd.concat([stable, delta]).resample(rule).sum().fillna(0)
+                    _write_persisted(engine, granularity, source, series, replace_after=stable_end)
+                    return series, {"mode": "incremental", "buckets": int((series.index > stable_end).sum())}
+
+            logger.info(f"Série {granularity} de {company}: histórico antigo mudou, reconstruindo.")
+
+        series = _read_raw(company, source, rule)
+        if series is None:
+            return None, {"mode": "full", "buckets": 0}
+        if not series.empty:
+            _write_persisted(engine, granularity, source, series)
+        return series, {"mode": "full", "buckets": len(series)}
+    finally:
+        engine.dispose()
+
+
+def load_warm_params(company='animoshop', granularity='weekly', source='limpas', spec=None):
+    """Parâmetros do último ajuste (mesmo spec) para warm start, ou None."""
+    engine = get_db_engine(company)
+    try:
+        if not inspect(engine).has_table(STATE_TABLE):
+            return None
+        df = pd.read_sql_query(
+            text(f"SELECT params FROM {STATE_TABLE} WHERE granularidade = :g AND fonte = :f AND spec = :s"),
+            engine, params={"g": granularity, "f": source, "s": spec}
+        )
+    finally:
+        engine.dispose()
+    return json.loads(df['params'].iloc[0]) if not df.empty else None
+
+
+def save_warm_params(company='animoshop', granularity='weekly', source='limpas', spec=None, params=None):
+    if not spec or params is None:
+        return
+    engine = get_db_engine(company)
+    try:
+        with engine.begin() as conn:
+            if inspect(conn).has_table(STATE_TABLE):
+                conn.execute(
+                    text(f"DELETE FROM {STATE_TABLE} WHERE granularidade = :g AND fonte = :f AND spec = :s"),
+                    {"g": granularity, "f": source, "s": spec}
+                )
+            pd.DataFrame([{
+                "granularidade": granularity, "fonte": source, "spec": spec,
+                "params": json.dumps([float(p) for p in params]),
+                "atualizado_em": pd.Timestamp.now().isoformat(),
+            }]).to_sql(STATE_TABLE, conn, if_exists='append', index=False)
+    finally:
+        engine.dispose()
@@ -0,0 +1,178 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from api.forecast import (
+    GRANULARITY_CONFIG, MODEL_CANDIDATES, BATCH_WORKERS,
+    load_series, fit_model, predict, select_model, candidate_specs
+)
+from api.parallel import run_in_pool
+
+# Ajuste para garantir encoding correto no terminal Windows
+if sys.stdout.encoding != 'utf-8':
+    sys.stdout.reconfigure(encoding='utf-8')
+
+# Backtest Rolling-Origin (janela expansível) do motor de forecast.
+# Para cada origem t: ajusta em y[:t], prevê t+1..t+h e compara com o realizado.
+# 'auto' reproduz o caminho de produção (seleção automática + ajuste do escolhido).
+
+DEFAULT_HORIZON = {'weekly': 12, 'monthly': 6}
+
+
+def synthetic_series(granularity='weekly', n_periods=None, seed=42):
+    """Série sintética: nível + tendência + sazonalidade anual + ruído multiplicativo."""
+    config = GRANULARITY_CONFIG[granularity]
+    m = config['seasonal_periods']
+    n_periods = n_periods or 3 * m
+    rng = np.random.default_rng(seed)
+
+    t = np.arange(n_periods)
+    level = 50000 + 150 * t * (52 / m)
+    season = 1 + 0.25 * np.sin(2 * np.pi * t / m)
+    values = level * season * rng.lognormal(0, 0.12, n_periods)
+
+    index = pd.date_range('2021-01-04', periods=n_periods, freq=config['resample_rule'])
+    return pd.Series(values, index=index)
+
+
+def rolling_origins(n_obs, granularity='weekly', horizon=12, step=None, min_train=None):
+    """Origens (tamanho do treino) da janela expansível."""
+    min_train = min_train or max(GRANULARITY_CONFIG[granularity]['min_history_trend'], n_obs // 2)
+    step = step or max(1, horizon // 2)
+    return list(range(min_train, n_obs - horizon + 1, step))
+
+
+def _backtest_fold_task(args):
+    """Worker (processo separado): ajusta um modelo numa origem e mede erro/cobertura/tempo."""
+    spec, series, granularity, train_size, horizon = args
+    train = series.iloc[:train_size]
+    actual = series.iloc[train_size:train_size + horizon].to_numpy(dtype=float)
+
+    t0 = time.perf_counter()
+    if spec == 'auto':
+        chosen = select_model(train, granularity, max_workers=1)['spec']
+    else:
+        chosen = spec
+        if spec not in candidate_specs(train, granularity):
+            return None
+    entry = fit_model(train, granularity, chosen)
+    fit_time = time.perf_counter() - t0
+
+    pred = np.maximum(np.asarray(predict(entry, horizon), dtype=float), 0)
+    margin = 1.96 * entry['resid_std'] * np.sqrt(np.arange(1, horizon + 1))
+    lower, upper = np.maximum(pred - margin, 0), pred + margin
+
+    nonzero = actual != 0
+    denom = np.abs(actual) + np.abs(pred)
+    return {
+        "model": spec,
+        "fitted": entry['model_name'],
+        "origin": str(series.index[train_size - 1].date()),
+        "ape_sum": float(np.sum(np.abs(actual[nonzero] - pred[nonzero]) / np.abs(actual[nonzero]))),
+        "ape_n": int(nonzero.sum()),
+        "smape_sum": float(np.sum(np.where(denom > 0, 2 * np.abs(actual - pred) / np.where(denom > 0, denom, 1), 0))),
+        "covered": int(np.sum((actual >= lower) & (actual <= upper))),
+        "n": int(horizon),
+        "fit_time": fit_time,
+    }
+
+
+def run_backtest(series, granularity='weekly', specs=None, horizon=None, step=None, max_workers=BATCH_WORKERS):
+    """
+    Roda todas as (modelo x origem) em paralelo e agrega por modelo.
+    Modelos inelegíveis numa origem (treino curto demais) não têm dobra nela; para o ranking
+    ser comparável, as métricas usam só as origens comuns a todos os modelos (coluna 'shared'
+    do detalhe). 'folds' é o nº de dobras comuns; 'folds_eligible', o total do modelo.
+    Retorna (resumo por modelo, detalhe por dobra).
+    """
+    specs = specs or ['auto'] + list(MODEL_CANDIDATES)
+    horizon = horizon or DEFAULT_HORIZON[granularity]
+    origins = rolling_origins(len(series), granularity, horizon, step)
+    if not origins:
+        return pd.DataFrame(), pd.DataFrame()
+
+    tasks = [(spec, series, granularity, origin, horizon) for spec in specs for origin in origins]
+    folds = pd.DataFrame([r for r in run_in_pool(_backtest_fold_task, tasks, max_workers) if r])
+    if folds.empty:
+        return folds, folds
+
+    # Origens em que todos os modelos com alguma dobra foram elegíveis
+    models_per_origin = folds.groupby('origin')['model'].nunique()
+    shared = models_per_origin.index[models_per_origin == folds['model'].nunique()]
+    folds['shared'] = folds['origin'].isin(shared)
+    eligible = folds.groupby('model')['origin'].count()
+    if not folds['shared'].any():
+        return pd.DataFrame(), folds
+
+    agg = folds[folds['shared']].groupby('model').agg(
+        ape_sum=('ape_sum', 'sum'), ape_n=('ape_n', 'sum'),
+        smape_sum=('smape_sum', 'sum'), covered=('covered', 'sum'), n=('n', 'sum'),
+        folds=('origin', 'count'), fit_time_mean=('fit_time', 'mean'), fit_time_total=('fit_time', 'sum'),
+    )
+    summary = pd.DataFrame({
+        "mape_pct": 100 * agg['ape_sum'] / agg['ape_n'].replace(0, np.nan),
+        "smape_pct": 100 * agg['smape_sum'] / agg['n'],
+        "coverage95_pct": 100 * agg['covered'] / agg['n'],
+        "folds": agg['folds'],
+        "folds_eligible": eligible.reindex(agg.index),
+        "fit_time_mean_s": agg['fit_time_mean'],
+        "fit_time_total_s": agg['fit_time_total'],
+    }).sort_values('smape_pct').round(3)
+    return summary, folds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backtest rolling-origin do forecast de faturamento.")
+    parser.add_argument('--company', default='animoshop', help="animoshop | novoon (ignorado com --synthetic)")
+    parser.add_argument('--granularity', default='both', choices=['weekly', 'monthly', 'both'])
+    parser.add_argument('--synthetic', action='store_true', help="Usa série sintética em vez do banco")
+    parser.add_argument('--periods', type=int, default=None, help="Tamanho da série sintética")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--horizon', type=int, default=None)
+    parser.add_argument('--step', type=int, default=None, help="Passo entre origens")
+    parser.add_argument('--models', default=None, help="Lista separada por vírgula (ex: auto,hw_add,holt)")
+    parser.add_argument('--workers', type=int, default=BATCH_WORKERS)
+    parser.add_argument('--csv', default=None, help="Salva o detalhe por dobra neste CSV")
+    args = parser.parse_args()
+
+    granularities = ['weekly', 'monthly'] if args.granularity == 'both' else [args.granularity]
+    specs = args.models.split(',') if args.models else None
+    all_folds = []
+
+    print("\n📈 BACKTEST ROLLING-ORIGIN DO FORECAST\n" + "="*80)
+    for granularity in granularities:
+        t0 = time.perf_counter()
+        if args.synthetic:
+            series = synthetic_series(granularity, args.periods, args.seed)
+            origem = f"sintética (seed={args.seed})"
+        else:
+            series = load_series(args.company, granularity)
+            origem = args.company
+        if series is None or len(series) < 8:
+            print(f"❌ {granularity}: série insuficiente ({origem}).")
+            continue
+
+        summary, folds = run_backtest(series, granularity, specs, args.horizon, args.step, args.workers)
+        elapsed = time.perf_counter() - t0
+
+        print(f"\n>>> {granularity.upper()} | série {origem}: {len(series)} obs | {elapsed:.1f}s total")
+        if summary.empty:
+            print("   ⚠️ Histórico curto demais para o horizonte pedido.")
+            continue
+        print(f"   Métricas nas {folds.loc[folds['shared'], 'origin'].nunique()} origens comuns a todos os modelos.")
+        print(summary.to_string())
+
+        folds['granularity'] = granularity
+        all_folds.append(folds)
+
+    if args.csv and all_folds:
+        pd.concat(all_folds, ignore_index=True).to_csv(args.csv, index=False)
+        print(f"\n💾 Detalhe por dobra salvo em: {os.path.abspath(args.csv)}")
+    print("="*80 + "\n")
+
+
+if __name__ == "__main__":
+    main()
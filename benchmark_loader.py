@@ -0,0 +1,151 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+import loader_nv as loader
+
+# Ajuste para garantir encoding correto no terminal Windows
+if sys.stdout.encoding != 'utf-8':
+    sys.stdout.reconfigure(encoding='utf-8')
+
+# Benchmark da carga de uma tabela consolidada no SQLite:
+#   to_sql padrão x to_sql(method='multi', chunksize) x gravar_tabela_bulk (executemany).
+# Cada método grava num banco temporário novo; o tempo inclui a criação do índice único.
+# A tabela gravada por cada método é relida e comparada inteira com a do to_sql padrão.
+
+TABELA = 'novoon_consolidado_geral'
+
+
+def synthetic_consolidado(n_rows=500000, seed=42):
+    """Consolidado sintético no formato de entrada do loader (colunas de COLUNAS_PADRAO)."""
+    rng = np.random.default_rng(seed)
+    datas = pd.Timestamp('2022-01-01') + pd.to_timedelta(rng.integers(0, 900, n_rows), unit='D')
+    meses = {v: k for k, v in loader.MESES_ORDEM.items()}
+    faturamento = rng.uniform(20, 400, n_rows).round(2)
+    df = pd.DataFrame({
+        'Id do Pedido Unificado': [f"PED{i // 2}" for i in range(n_rows)],
+        'Produto': rng.choice([f"Produto {i}" for i in range(80)], n_rows),
+        'MarketPlace': rng.choice(['Amazon', 'Shopee', 'Mercado Livre', 'Magalu'], n_rows),
+        'dia': datas.day, 'mes': datas.month.map(meses), 'ano': datas.year,
+        'Cidade': 'São Paulo', 'UF': 'SP', 'CEP': '01000-000',
+        'Faturamento': faturamento, 'Frete': -(faturamento * 0.1).round(2),
+        'Comissões': -(faturamento * 0.15).round(2), 'Custo Operacional': -(faturamento * 0.25).round(2),
+        'Lucro Bruto': (faturamento * 0.75).round(2),
+    })
+    # Nulos e datas inválidas (dia 31 -> data_filtro NaT em meses curtos) para exercitar NULL
+    df.loc[rng.random(n_rows) < 0.02, 'CEP'] = None
+    df.loc[rng.random(n_rows) < 0.01, 'dia'] = 31
+    return df
+
+
+def _indice(tabela):
+    return f"CREATE UNIQUE INDEX IF NOT EXISTS uq_{tabela}_{loader.COLUNA_CHAVE} ON {tabela} ({loader.COLUNA_CHAVE})"
+
+
+def _to_sql(df, engine, **kwargs):
+    df.to_sql(TABELA, engine, if_exists='replace', index=False, **kwargs)
+    with engine.begin() as conn:
+        conn.execute(text(_indice(TABELA)))
+
+
+def _read_table(engine):
+    """Conteúdo gravado (todas as colunas, como texto/número do SQLite) em ordem de chave."""
+    return pd.read_sql_query(
+        text(f"SELECT * FROM {TABELA} ORDER BY {loader.COLUNA_CHAVE}"), engine, coerce_float=False
+    )
+
+
+def check_type_roundtrip():
+    """
+    Confere, por tipo, que gravar_tabela_bulk grava exatamente o mesmo que o to_sql:
+    datas (e NaT), Int64 com NA, bool, texto com None e float com NaN.
+    """
+    sonda = pd.DataFrame({
+        "data": pd.to_datetime(['2024-01-02 10:30:00', None, '2023-12-31 00:00:00']),
+        "inteiro_nulo": pd.array([1, None, -7], dtype='Int64'),
+        "inteiro": [1, 2, 3],
+        "flag": [True, False, True],
+        "texto": ['a', None, 'ç'],
+        "valor": [1.5, float('nan'), -0.25],
+    })
+    with tempfile.TemporaryDirectory() as pasta:
+        tabelas = []
+        for nome in ('to_sql', 'bulk'):
+            engine = create_engine(f"sqlite:///{os.path.join(pasta, f'sonda_{nome}.db')}")
+            if nome == 'to_sql':
+                sonda.to_sql('sonda', engine, if_exists='replace', index=False)
+            else:
+                loader.gravar_tabela_bulk(sonda, 'sonda', engine)
+            with engine.connect() as conn:
+                tipos = conn.execute(text("SELECT * FROM pragma_table_info('sonda')")).fetchall()
+            valores = pd.read_sql_query(text("SELECT * FROM sonda"), engine, coerce_float=False)
+            engine.dispose()
+            tabelas.append(([(c[1], c[2]) for c in tipos], valores))
+    assert tabelas[0][0] == tabelas[1][0], f"Schema diverge: {tabelas[0][0]} x {tabelas[1][0]}"
+    pd.testing.assert_frame_equal(tabelas[1][1], tabelas[0][1], check_exact=True, obj='sonda bulk')
+
+
+def run_benchmark(df, chunksize=500, repeats=1):
+    """
+    Tempo médio de cada método (segundos). O conteúdo gravado por cada método é comparado
+    coluna a coluna com o do to_sql padrão (datas, inteiros nulos, NULLs): AssertionError se divergir.
+    """
+    metodos = {
+        "to_sql": lambda e: _to_sql(df, e),
+        f"to_sql multi (chunksize={chunksize})": lambda e: _to_sql(df, e, method='multi', chunksize=chunksize),
+        "bulk executemany": lambda e: loader.gravar_tabela_bulk(df, TABELA, e, [_indice(TABELA)]),
+    }
+    resultados = []
+    referencia = None
+    with tempfile.TemporaryDirectory() as pasta:
+        for i, (nome, carregar) in enumerate(metodos.items()):
+            tempos = []
+            for r in range(repeats):
+                engine = create_engine(f"sqlite:///{os.path.join(pasta, f'bench_{i}_{r}.db')}")
+                t0 = time.perf_counter()
+                carregar(engine)
+                tempos.append(time.perf_counter() - t0)
+                gravado = _read_table(engine)
+                engine.dispose()
+            if referencia is None:
+                referencia = gravado
+            else:
+                pd.testing.assert_frame_equal(gravado, referencia, check_exact=True, obj=nome)
+            media = float(np.mean(tempos))
+            resultados.append({"metodo": nome, "segundos": round(media, 3), "linhas_s": int(len(df) / media),
+                               "linhas": len(gravado), "identico_to_sql": True})
+    return pd.DataFrame(resultados).set_index('metodo')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark da carga da tabela consolidada no SQLite.")
+    parser.add_argument('--csv', default=None, help="CSV consolidado real (padrão: dados sintéticos)")
+    parser.add_argument('--rows', type=int, default=500000, help="Linhas do consolidado sintético")
+    parser.add_argument('--chunksize', type=int, default=500, help="chunksize do to_sql method='multi'")
+    parser.add_argument('--repeats', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.csv:
+        df = pd.read_csv(args.csv, dtype={'Id do Pedido Unificado': str})
+        origem = os.path.basename(args.csv)
+    else:
+        df = synthetic_consolidado(args.rows)
+        origem = "sintético"
+    df = loader.adicionar_chave_linha(loader.processar_dataframe(df, TABELA))
+
+    print("\n🗄️  BENCHMARK DE CARGA SQLITE\n" + "="*80)
+    print(f"Tabela: {TABELA} | origem: {origem} | {len(df):,} linhas x {len(df.columns)} colunas")
+    check_type_roundtrip()
+    print("Sonda de tipos (datas, Int64/NA, bool, NULL): bulk idêntico ao to_sql.")
+    resumo = run_benchmark(df, args.chunksize, args.repeats)
+    print(resumo.to_string())
+    print("="*80 + "\n")
+
+
+if __name__ == "__main__":
+    main()
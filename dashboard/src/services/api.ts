@@ -71,6 +71,14 @@ export const getForecast = async (filters?: Filters, granularity: 'weekly' | 'mo
     return response.data;
 };
 
+export const getForecastByDimension = async (filters?: Filters, dimension: 'marketplace' | 'produto' = 'marketplace', key?: string, granularity: 'weekly' | 'monthly' = 'weekly'): Promise<any[]> => {
+    const params: any = { dimension, granularity };
+    if (key) params.key = key;
+    if (filters?.company) params.company = filters.company;
+    const response = await api.get('/forecast/by-dimension', { params });
+    return response.data;
+};
+
 export const getClustering = async (filters?: Filters): Promise<any> => {
     const response = await api.get('/analysis/clustering', getParams(filters));
     return response.data;
@@ -99,3 +107,9 @@ export const getRiskAnalysis = async (filters?: Filters): Promise<RiskData> => {
     const response = await api.get<RiskData>('/analysis/risk-analysis', getParams(filters));
     return response.data;
 };
+
+export const getRiskSeries = async (filters?: Filters, granularity: 'weekly' | 'monthly' = 'monthly', window: number = 1): Promise<any> => {
+    const { params } = getParams(filters);
+    const response = await api.get('/analysis/risk-analysis/series', { params: { ...params, granularity, window } });
+    return response.data;
+};
@@ -1,5 +1,6 @@
 import time
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 # Importa seus scripts como se fossem bibliotecas
 # Certifique-se que os arquivos .py estão na mesma pasta
@@ -13,6 +14,65 @@ import atom_nv as atom            # Seu script de conciliação
 import loader_nv as loader_sql # Script de carregamento (Loader)
 import unificar_planilhas_nv as unificar # Script de unificação
 
+# Nº de processos da Fase 1 (ETL_WORKERS=1 -> sequencial; vazio -> um por marketplace)
+ETL_WORKERS = int(os.environ.get('ETL_WORKERS', '0')) or None
+
+# Fase 1: marketplaces independentes entre si (cada um lê/grava só os próprios arquivos)
+TAREFAS_MARKETPLACES = [
+    ("Amazon", amazon.processar_amazon),
+    ("Shopee", shopee.processar_shopee),
+    ("Mercado Livre", mercado_livre.processar_mercadolivre),
+    ("Magalu", magalu.processar_magalu),
+    ("MadeiraMadeira", madeira_madeira.processar_madeira),
+    ("Olist", olist.processar_olist),
+]
+
+
+def _executar_tarefa(tarefa):
+    """Roda um marketplace isolado: mede o tempo e captura o erro sem derrubar os demais."""
+    nome, funcao = tarefa
+    inicio = time.time()
+    try:
+        funcao()
+        return nome, True, time.time() - inicio, None
+    except Exception as e:
+        return nome, False, time.time() - inicio, str(e)
+
+
+def executar_fase_marketplaces(max_workers=ETL_WORKERS):
+    """
+    Fase 1 em paralelo (ProcessPoolExecutor). O tempo total tende ao do marketplace
+    mais lento. Se o pool não puder ser criado, roda sequencial.
+    Retorna [(nome, sucesso, segundos, erro)].
+    """
+    inicio = time.time()
+    workers = max_workers or len(TAREFAS_MARKETPLACES)
+    resultados = []
+
+    if workers == 1:
+        resultados = [_executar_tarefa(t) for t in TAREFAS_MARKETPLACES]
+    else:
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futuros = [executor.submit(_executar_tarefa, t) for t in TAREFAS_MARKETPLACES]
+                for futuro in as_completed(futuros):
+                    resultados.append(futuro.result())
+        except Exception as e:
+            print(f"⚠️ Pool de processos indisponível ({e}). Rodando sequencial.")
+            feitos = {r[0] for r in resultados}
+            resultados += [_executar_tarefa(t) for t in TAREFAS_MARKETPLACES if t[0] not in feitos]
+
+    print("\n" + "-"*40)
+    print("Resumo da Fase 1:")
+    for nome, sucesso, segundos, erro in sorted(resultados, key=lambda r: -r[2]):
+        if sucesso:
+            print(f"✅ {nome}: {segundos:.2f}s")
+        else:
+            print(f"❌ Falha em {nome} ({segundos:.2f}s): {erro}")
+    print(f"Fase 1 concluída em {time.time() - inicio:.2f}s ({workers} processo(s)).")
+    return resultados
+
+
 def main():
     inicio_total = time.time()
     
@@ -23,29 +83,7 @@ def main():
     # --- PASSO 1: LIMPEZA E PADRONIZAÇÃO (Marketplaces) ---
     print("\n>>> FASE 1: PROCESSANDO MARKETPLACES...")
     
-    try:
-        amazon.processar_amazon()
-    except Exception as e: print(f"❌ Falha na Amazon: {e}")
-
-    try:
-        shopee.processar_shopee()
-    except Exception as e: print(f"❌ Falha na Shopee: {e}")
-
-    try:
-        mercado_livre.processar_mercadolivre()
-    except Exception as e: print(f"❌ Falha no Mercado Livre: {e}")
-
-    try:
-        magalu.processar_magalu()
-    except Exception as e: print(f"❌ Falha no Magalu: {e}")
-
-    try:
-        madeira_madeira.processar_madeira()
-    except Exception as e: print(f"❌ Falha na MadeiraMadeira: {e}")
-
-    try:
-        olist.processar_olist()
-    except Exception as e: print(f"❌ Falha no Olist: {e}")
+    executar_fase_marketplaces()
 
     # --- PASSO 2: UNIFICAÇÃO (CONSOLIDAÇÃO) ---
     print("\n>>> FASE 2: UNIFICANDO PLANILHAS GERAIS...")
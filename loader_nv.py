@@ -1,6 +1,8 @@
 import pandas as pd
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 import os
+import sys
+import time
 from unificar_planilhas_nv import normalize_uf, MESES_ORDEM, COLUNAS_PADRAO
 
 # Novoon map might be different or same. Let's assume standardized. If MAPA_COLUNAS likely exists.
@@ -20,6 +22,13 @@ DIRETORIOS = {
     'CONCILIADO':  os.path.join(BASE_DIR, 'Dados', 'Novoon', 'planilhas atom')
 }
 
+# Carga incremental (CARGA_INCREMENTAL=1): as tabelas consolidadas recebem só o delta
+# (upsert pela chave natural pedido + produto + marketplace + data) numa única transação.
+CARGA_INCREMENTAL = os.environ.get('CARGA_INCREMENTAL', '0') == '1'
+CHAVE_NATURAL = ['id_do_pedido_unificado', 'produto', 'marketplace', 'data_filtro']
+COLUNA_CHAVE = 'chave_linha'
+COLUNA_HASH = 'hash_linha'
+
 def limpar_nome_tabela(nome_arquivo):
     """
     Transforma 'mercado_livre_consolidado_final.csv' em 'mercado_livre_consolidado'
@@ -85,9 +94,138 @@ def processar_dataframe(df, nome_tabela):
     
     return df_final
 
-def criar_banco_dados():
+def adicionar_chave_linha(df):
+    """
+    Acrescenta chave_linha (hash da chave natural + nº da ocorrência, para linhas repetidas
+    do mesmo pedido/produto/dia) e hash_linha (hash do conteúdo), ambos int64.
+    Gravadas nas duas formas de carga para o schema das tabelas ser sempre o mesmo.
+    """
+    valores = df.columns.tolist()
+    chave = df[CHAVE_NATURAL].copy()
+    chave['ocorrencia'] = chave.groupby(CHAVE_NATURAL, dropna=False).cumcount()
+    df[COLUNA_CHAVE] = pd.util.hash_pandas_object(chave, index=False).to_numpy().view('int64')
+    df[COLUNA_HASH] = pd.util.hash_pandas_object(df[valores], index=False).to_numpy().view('int64')
+    return df
+
+def carregar_incremental(df, nome_tabela, engine):
+    """
+    Upsert do delta numa única transação:
+    - compara (chave_linha, hash_linha) do CSV com o que está no banco (só essas 2 colunas são lidas);
+    - linhas novas/alteradas vão para uma tabela de staging e entram via INSERT ... ON CONFLICT DO UPDATE;
+    - chaves que sumiram do CSV são removidas.
+    Tabela inexistente ou com schema diferente é recriada inteira.
+    Retorna {"inseridas", "atualizadas", "removidas", "modo"}.
+    """
+    stage = f"stage_{nome_tabela}_upsert"
+    with engine.begin() as conn:
+        insp = inspect(conn)
+        colunas_db = {c['name'] for c in insp.get_columns(nome_tabela)} if insp.has_table(nome_tabela) else set()
+        if colunas_db != set(df.columns):
+            df.to_sql(nome_tabela, conn, if_exists='replace', index=False)
+            conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS uq_{nome_tabela}_{COLUNA_CHAVE} ON {nome_tabela} ({COLUNA_CHAVE})"))
+            return {"inseridas": len(df), "atualizadas": 0, "removidas": 0, "modo": "completa"}
+
+        atual = pd.read_sql_query(text(f"SELECT {COLUNA_CHAVE}, {COLUNA_HASH} FROM {nome_tabela}"), conn)
+        comparacao = df[[COLUNA_CHAVE, COLUNA_HASH]].merge(
+            atual, on=COLUNA_CHAVE, how='outer', suffixes=('', '_db'), indicator=True
+        )
+        novas = comparacao['_merge'] == 'left_only'
+        alteradas = (comparacao['_merge'] == 'both') & (comparacao[COLUNA_HASH] != comparacao[f"{COLUNA_HASH}_db"])
+        removidas = comparacao.loc[comparacao['_merge'] == 'right_only', [COLUNA_CHAVE]]
+
+        if len(removidas):
+            removidas.to_sql(stage, conn, if_exists='replace', index=False)
+            conn.execute(text(f"DELETE FROM {nome_tabela} WHERE {COLUNA_CHAVE} IN (SELECT {COLUNA_CHAVE} FROM {stage})"))
+
+        delta = df[df[COLUNA_CHAVE].isin(comparacao.loc[novas | alteradas, COLUNA_CHAVE])]
+        if len(delta):
+            delta.to_sql(stage, conn, if_exists='replace', index=False)
+            colunas = ', '.join(f'"{c}"' for c in df.columns)
+            atualizar = ', '.join(f'"{c}" = excluded."{c}"' for c in df.columns if c != COLUNA_CHAVE)
+            # "WHERE true" evita a ambiguidade do parser do SQLite entre SELECT e ON CONFLICT
+            conn.execute(text(
+                f"INSERT INTO {nome_tabela} ({colunas}) SELECT {colunas} FROM {stage} WHERE true "
+                f"ON CONFLICT({COLUNA_CHAVE}) DO UPDATE SET {atualizar}"
+            ))
+        conn.execute(text(f"DROP TABLE IF EXISTS {stage}"))
+
+    return {"inseridas": int(novas.sum()), "atualizadas": int(alteradas.sum()), "removidas": len(removidas), "modo": "incremental"}
+
+def _tipo_sqlite(serie):
+    """Tipo da coluna igual ao que o to_sql cria (schema idêntico nos dois caminhos de carga)."""
+    if pd.api.types.is_bool_dtype(serie): return 'BOOLEAN'
+    if pd.api.types.is_integer_dtype(serie): return 'BIGINT'
+    if pd.api.types.is_float_dtype(serie): return 'FLOAT'
+    if pd.api.types.is_datetime64_any_dtype(serie): return 'DATETIME'
+    return 'TEXT'
+
+def _valores_sqlite(serie):
+    """Coluna -> lista de valores nativos (NaN/NaT/NA -> NULL; datas no mesmo formato do to_sql)."""
+    if pd.api.types.is_float_dtype(serie):
+        return serie.tolist() # NaN já vira NULL no SQLite
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        serie = serie.dt.strftime('%Y-%m-%d %H:%M:%S.%f')
+    return serie.astype(object).where(serie.notna(), None).tolist()
+
+def gravar_tabela_bulk(df, nome_tabela, engine, indices=()):
+    """
+    Carga em massa (substitui a tabela) via sqlite3.executemany com um único INSERT preparado
+    e uma única transação. Durante a carga: synchronous=OFF e journal em memória (os modos
+    anteriores da conexão são restaurados ao final); os índices
+    (lista de CREATE INDEX) só são criados depois dos dados.
+    Em bancos que não sejam SQLite cai no to_sql.
+    """
+    if engine.dialect.name != 'sqlite':
+        df.to_sql(nome_tabela, engine, if_exists='replace', index=False, method='multi', chunksize=1000)
+        with engine.begin() as conn:
+            for sql in indices:
+                conn.execute(text(sql))
+        return
+
+    colunas = ', '.join(f'"{c}"' for c in df.columns)
+    ddl = ', '.join(f'"{c}" {_tipo_sqlite(df[c])}' for c in df.columns)
+    insert = f'INSERT INTO "{nome_tabela}" ({colunas}) VALUES ({", ".join("?" * len(df.columns))})'
+    linhas = zip(*[_valores_sqlite(df[c]) for c in df.columns])
+
+    raw = engine.raw_connection()
+    cur = raw.cursor()
+    # Modos atuais da conexão (ex.: WAL/NORMAL configurados no banco), restaurados no final
+    synchronous_anterior = cur.execute("PRAGMA synchronous").fetchone()[0]
+    journal_anterior = cur.execute("PRAGMA journal_mode").fetchone()[0]
+    try:
+        cur.execute("PRAGMA synchronous = OFF")
+        cur.execute("PRAGMA journal_mode = MEMORY")
+        cur.execute("BEGIN")
+        cur.execute(f'DROP TABLE IF EXISTS "{nome_tabela}"')
+        cur.execute(f'CREATE TABLE "{nome_tabela}" ({ddl})')
+        cur.executemany(insert, linhas)
+        for sql in indices:
+            cur.execute(sql)
+        raw.commit()
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        # Conexão volta ao pool: restaura os modos anteriores à carga
+        cur.execute(f"PRAGMA synchronous = {int(synchronous_anterior)}")
+        cur.execute(f"PRAGMA journal_mode = {journal_anterior}")
+        cur.close()
+        raw.close()
+
+def registrar_versao_dados(engine):
+    """
+    Grava a versão da carga (tabela etl_versao). A API usa esse valor como chave
+    dos caches de modelos/resultados, que ficam inválidos a cada novo ETL.
+    """
+    versao = str(time.time_ns())
+    df_versao = pd.DataFrame([{'versao': versao, 'carregado_em': pd.Timestamp.now().isoformat()}])
+    df_versao.to_sql('etl_versao', engine, if_exists='replace', index=False)
+    return versao
+
+def criar_banco_dados(incremental=CARGA_INCREMENTAL):
     print("="*80)
     print("CRIANDO BANCO DE DADOS SQL (MASTER) - VIA SQLALCHEMY")
+    print(f"Modo de carga: {'incremental (upsert do delta)' if incremental else 'completa (replace)'}")
     print(f"Connection String: {CONNECTION_STRING}")
     print("="*80)
 
@@ -103,6 +241,7 @@ def criar_banco_dados():
 
     total_tabelas = 0
     total_linhas = 0
+    totais_delta = {"inseridas": 0, "atualizadas": 0, "removidas": 0}
 
     for tipo_dado, pasta in DIRETORIOS.items():
         print(f"\n📂 Processando pasta: {tipo_dado} ...")
@@ -123,19 +262,28 @@ def criar_banco_dados():
                 
                 # PROCESSA E NORMALIZA O DATAFRAME
                 if tipo_dado == 'CONSOLIDADO':
-                     df = processar_dataframe(df, nome_tabela)
+                     df = adicionar_chave_linha(processar_dataframe(df, nome_tabela))
                 else:
                      # Para Conciliado, mantemos logica simples ou adaptamos?
                      # Conciliado (Atom) tem colunas diferentes. Mantemos raw por enquanto.
                      # Mas limpamos nomes
                      df.columns = df.columns.str.strip().str.lower().str.replace(' ', '_').str.replace('/', '_')
 
-                # Salva no SQL usando SQLAlchemy Engine
-                # if_exists='replace' -> Se rodar de novo, ele atualiza a tabela inteira
-                df.to_sql(nome_tabela, engine, if_exists='replace', index=False)
-                
                 qtd = len(df)
-                print(f"   ✅ Tabela criada: {nome_tabela:<30} ({qtd} registros)")
+                if incremental and tipo_dado == 'CONSOLIDADO':
+                    # Só o delta é gravado (upsert pela chave natural)
+                    delta = carregar_incremental(df, nome_tabela, engine)
+                    for k in totais_delta:
+                        totais_delta[k] += delta[k]
+                    print(f"   ✅ Tabela {delta['modo']}: {nome_tabela:<30} ({qtd} registros | "
+                          f"+{delta['inseridas']} ~{delta['atualizadas']} -{delta['removidas']})")
+                else:
+                    # Carga em massa (executemany): se rodar de novo, ele substitui a tabela inteira
+                    indices = []
+                    if tipo_dado == 'CONSOLIDADO':
+                        indices.append(f"CREATE UNIQUE INDEX IF NOT EXISTS uq_{nome_tabela}_{COLUNA_CHAVE} ON {nome_tabela} ({COLUNA_CHAVE})")
+                    gravar_tabela_bulk(df, nome_tabela, engine, indices)
+                    print(f"   ✅ Tabela criada: {nome_tabela:<30} ({qtd} registros)")
                 
                 total_tabelas += 1
                 total_linhas += qtd
@@ -143,12 +291,19 @@ def criar_banco_dados():
             except Exception as e:
                 print(f"   ❌ Erro ao processar {arquivo}: {e}")
 
+    versao = registrar_versao_dados(engine)
+
     print("\n" + "="*80)
     print("PROCESSO FINALIZADO COM SUCESSO!")
     print(f"   - Tabelas criadas: {total_tabelas}")
     print(f"   - Total de linhas importadas: {total_linhas:,}")
+    if incremental:
+        print(f"   - Delta: {totais_delta['inseridas']:,} inseridas | {totais_delta['atualizadas']:,} atualizadas | {totais_delta['removidas']:,} removidas")
     print(f"   - Banco salvo em: {CAMINHO_DB}")
+    print(f"   - Versão dos dados: {versao}")
     print("="*80)
+    return {"versao": versao, "tabelas": total_tabelas, "linhas": total_linhas, **totais_delta}
 
 if __name__ == "__main__":
-    criar_banco_dados()
+    # python loader.py --incremental -> upsert só do delta
+    criar_banco_dados(incremental=CARGA_INCREMENTAL or '--incremental' in sys.argv)
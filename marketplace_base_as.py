@@ -2,10 +2,35 @@ import pandas as pd
 import os
 import warnings
 import re
+import json
+import shutil
+import hashlib
+from pathlib import Path
 
 # Ignora avisos desnecessários
 warnings.filterwarnings('ignore')
 
+# --- CARGA INCREMENTAL ---
+# Manifesto por marketplace (arquivo -> sha256, tamanho, mtime, linhas) e histórico
+# já processado (pickle com a coluna de origem). A cada execução só os arquivos novos
+# ou alterados são lidos; as linhas deles substituem as antigas do mesmo arquivo e o
+# consolidado final é regravado a partir do histórico completo.
+EXTENSOES_ENTRADA = ('.csv', '.xlsx', '.xls')
+COLUNA_ARQUIVO = '_arquivo_origem'
+PASTA_INCREMENTAL = '_incremental'
+# ETL_FULL_REFRESH=1 ignora manifesto/histórico e reprocessa tudo
+FULL_REFRESH = os.environ.get('ETL_FULL_REFRESH', '0') == '1'
+
+
+def file_sha256(file_path, chunk_size=1 << 20):
+    """Hash do conteúdo do arquivo (lido em blocos)."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for bloco in iter(lambda: f.read(chunk_size), b''):
+            digest.update(bloco)
+    return digest.hexdigest()
+
+
 class MarketplaceBase:
     def __init__(self, marketplace_name, input_folder, output_folder, final_filename):
         self.marketplace_name = marketplace_name
@@ -15,6 +40,26 @@ class MarketplaceBase:
         self.dfs = []
         self.df_final = pd.DataFrame()
 
+        # Controle incremental: manifesto atual e arquivos lidos nesta execução
+        slug = marketplace_name.lower().replace(' ', '_')
+        self.incremental_dir = Path(output_folder) / PASTA_INCREMENTAL
+        self.manifest_path = self.incremental_dir / f"{slug}_manifesto.json"
+        self.history_path = self.incremental_dir / f"{slug}_historico.pkl"
+        self.manifest = {}
+        self.manifest_changed = False
+        self.pending_files = {}
+
+        # Performance: Controle de arquivos processados
+        self.files_to_move = []
+        self.processed_dir = Path(self.input_folder) / 'Processados'
+
+        # Cria pasta se não existir
+        try:
+            self.processed_dir.mkdir(parents=True, exist_ok=True)
+        except Exception as e:
+            print(f"Erro ao criar pasta Processados: {e}")
+            self.processed_dir = None
+
     def _read_file(self, file_path):
         """
         Método genérico para ler arquivos. Pode ser sobrescrito se necessário.
@@ -36,30 +81,165 @@ class MarketplaceBase:
             return None
         return None
 
+    def load_manifest(self):
+        if FULL_REFRESH or not self.manifest_path.exists():
+            return {}
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"⚠ Manifesto ilegível ({e}), reprocessando tudo.")
+            return {}
+
+    def load_history(self):
+        if FULL_REFRESH or not self.history_path.exists():
+            return None
+        try:
+            return pd.read_pickle(self.history_path)
+        except Exception as e:
+            print(f"⚠ Histórico ilegível ({e}), reprocessando tudo.")
+            return None
+
+    def list_input_files(self):
+        """
+        Arquivos da raiz e da pasta Processados (por nome; a raiz prevalece).
+        Os já processados entram na lista para o manifesto reconhecê-los
+        e para o histórico poder ser reconstruído se for perdido.
+        """
+        arquivos = {}
+        pastas = [self.processed_dir, Path(self.input_folder)] if self.processed_dir else [Path(self.input_folder)]
+        for pasta in pastas:
+            if pasta.exists():
+                for f in pasta.iterdir():
+                    if f.is_file() and f.suffix.lower() in EXTENSOES_ENTRADA:
+                        arquivos[f.name] = f
+        return [arquivos[nome] for nome in sorted(arquivos)]
+
+    def fingerprint_if_changed(self, file_path):
+        """
+        None se o arquivo já consta no manifesto com o mesmo conteúdo;
+        senão a impressão digital {sha256, tamanho, mtime} a registrar.
+        Tamanho + mtime iguais dispensam o hash.
+        """
+        stat = file_path.stat()
+        entrada = self.manifest.get(file_path.name)
+        if entrada and entrada['tamanho'] == stat.st_size and entrada['mtime'] == stat.st_mtime:
+            return None
+
+        digest = file_sha256(file_path)
+        if entrada and entrada['sha256'] == digest:
+            # Só o mtime mudou: registra para não refazer o hash na próxima execução
+            entrada['mtime'] = stat.st_mtime
+            self.manifest_changed = True
+            return None
+        return {"sha256": digest, "tamanho": stat.st_size, "mtime": stat.st_mtime}
+
     def load_data(self):
         print("="*80)
-        print(f"PROCESSANDO CONSOLIDAÇÃO {self.marketplace_name.upper()}...")
-        
-        if not os.path.exists(self.input_folder):
-            print(f"❌ Pasta de entrada não encontrada: {self.input_folder}")
+        print(f"PROCESSANDO CONSOLIDAÇÃO {self.marketplace_name.upper()} (Incremental)...")
+
+        input_path = Path(self.input_folder)
+        if not input_path.exists():
+            print(f"❌ Pasta de entrada não encontrada: {input_path}")
             return
 
-        arquivos = [f for f in os.listdir(self.input_folder) if f.endswith(('.csv', '.xlsx', '.xls'))]
-        
-        for file in arquivos:
-            caminho = os.path.join(self.input_folder, file)
-            df = self._read_file(caminho)
-            
-            if df is not None:
-                # Padroniza colunas para evitar problemas de espaço
-                df.columns = df.columns.str.strip()
-                self.dfs.append(df)
+        self.manifest = self.load_manifest()
+        self.manifest_changed = False
+        self.pending_files = {}
+        arquivos = self.list_input_files()
 
+        for file_path in arquivos:
+            na_raiz = file_path.parent == input_path
+            try:
+                fingerprint = self.fingerprint_if_changed(file_path)
+                if fingerprint is None:
+                    # Conteúdo já incorporado ao histórico
+                    if na_raiz:
+                        self.files_to_move.append(file_path)
+                    continue
+
+                # O método _read_file espera string ou path-like
+                df = self._read_file(str(file_path))
+
+                if df is not None and not df.empty:
+                    # Padroniza colunas e marca a origem de cada linha
+                    df.columns = df.columns.str.strip()
+                    df[COLUNA_ARQUIVO] = file_path.name
+                    self.dfs.append(df)
+                    self.pending_files[file_path.name] = fingerprint
+                    if na_raiz:
+                        self.files_to_move.append(file_path)
+                    print(f" -> Lido com sucesso: {file_path.name}")
+                else:
+                    print(f" -> Arquivo vazio ou ilegível (ignorado): {file_path.name}")
+            except Exception as e:
+                print(f"❌ ERRO CRÍTICO ao ler {file_path.name}: {e}")
+                # Não adiciona a files_to_move
+
+        print(f"Encontrados {len(arquivos)} arquivos ({len(self.pending_files)} novos/alterados).")
+        if self.manifest_changed:
+            self.save_manifest()
         if not self.dfs:
-            print("❌ Nenhum arquivo processado.")
+            print("❌ Nenhum arquivo novo processado.")
         else:
             self.df_final = pd.concat(self.dfs, ignore_index=True)
 
+    def save_manifest(self):
+        self.incremental_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+        self.manifest_changed = False
+
+    def merge_history(self):
+        """
+        Junta as linhas recém-processadas ao histórico persistido (as linhas antigas dos
+        arquivos relidos são substituídas), grava histórico + manifesto e devolve o total.
+        """
+        historico = self.load_history()
+        if historico is not None and not historico.empty:
+            historico = historico[~historico[COLUNA_ARQUIVO].isin(list(self.pending_files))]
+            df_total = pd.concat([historico, self.df_final], ignore_index=True)
+        else:
+            df_total = self.df_final
+
+        self.incremental_dir.mkdir(parents=True, exist_ok=True)
+        # Grava em arquivo temporário e troca (não corrompe o histórico se falhar no meio)
+        tmp_path = self.history_path.with_suffix('.tmp')
+        df_total.to_pickle(tmp_path)
+        os.replace(tmp_path, self.history_path)
+
+        linhas = self.df_final[COLUNA_ARQUIVO].value_counts()
+        agora = pd.Timestamp.now().isoformat()
+        for nome, fingerprint in self.pending_files.items():
+            self.manifest[nome] = {**fingerprint, "linhas": int(linhas.get(nome, 0)), "processado_em": agora}
+        self.save_manifest()
+
+        print(f"   [INCREMENTAL] Novas/alteradas: {len(self.df_final)} linhas de {len(self.pending_files)} arquivos | Histórico: {len(df_total)} linhas")
+        return df_total
+
+    def move_processed_files(self):
+        """Move arquivos processados com sucesso para a pasta Processados"""
+        if not self.files_to_move or not self.processed_dir:
+            return
+
+        print("\n" + "-"*40)
+        print("Movendo arquivos processados...")
+        count = 0
+        for src_path in self.files_to_move:
+            dst_path = self.processed_dir / src_path.name
+
+            try:
+                if dst_path.exists():
+                    dst_path.unlink() # Remove destino se existir
+
+                shutil.move(str(src_path), str(dst_path))
+                count += 1
+            except Exception as e:
+                print(f"Erro ao mover {src_path.name}: {e}")
+
+        print(f"Arquivos movidos: {count}/{len(self.files_to_move)}")
+        self.files_to_move = [] # Limpa lista
+
     def filter_cancelations(self):
         """Implementar nas classes filhas se necessário"""
         pass
@@ -111,6 +291,12 @@ class MarketplaceBase:
                     break
 
     def save_and_segregate(self):
+        # Histórico completo (arquivos anteriores + novos); a coluna de origem não vai para o CSV.
+        # Feito antes do teste de vazio: um arquivo alterado pode ter zerado as próprias linhas.
+        if self.pending_files:
+            self.df_final = self.merge_history()
+        self.df_final = self.df_final.drop(columns=[COLUNA_ARQUIVO], errors='ignore')
+
         if self.df_final.empty:
             return
 
@@ -167,6 +353,8 @@ class MarketplaceBase:
     def process(self):
         self.load_data()
         if self.df_final.empty:
+            # Nada novo, mas arquivos já incorporados ao histórico ainda saem da raiz
+            self.move_processed_files()
             return
         
         self.filter_cancelations()
@@ -186,6 +374,7 @@ class MarketplaceBase:
 
         self.save_and_segregate()
         self.print_summary()
+        self.move_processed_files()
 
     def custom_preprocessing(self):
         """Hook para ser sobrescrito com remoção de colunas, renomeação específica, etc."""
@@ -1,7 +1,5 @@
 import pandas as pd
 import os
-import shutil
-from pathlib import Path
 from marketplace_base_as import MarketplaceBase
 
 class MercadoLivreProcessor(MarketplaceBase):
@@ -108,10 +106,6 @@ class MercadoLivreProcessor(MarketplaceBase):
             self.df_final['mes'] = 'Desconhecido'
             self.df_final['ano'] = pd.NA
 
-    def process(self):
-        super().process() # Executa fluxo padrão da base
-        self.move_processed_files() # Executa movimentação no final
-
 def processar_mercadolivre():
     processor = MercadoLivreProcessor()
     processor.process()
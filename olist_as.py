@@ -1,8 +1,6 @@
 import pandas as pd
 import os
 import warnings
-import shutil
-from pathlib import Path
 from marketplace_base_as import MarketplaceBase
 
 # Ignorar avisos desnecessários do Excel
@@ -27,79 +25,6 @@ class OlistProcessor(MarketplaceBase):
             1: 'Janeiro', 2: 'Fevereiro', 3: 'Março', 4: 'Abril', 5: 'Maio', 6: 'Junho',
             7: 'Julho', 8: 'Agosto', 9: 'Setembro', 10: 'Outubro', 11: 'Novembro', 12: 'Dezembro'
         }
-        
-        # Performance: Controle de arquivos processados
-        self.files_to_move = []
-        self.processed_dir = Path(self.input_folder) / 'Processados'
-        
-        # Cria pasta se não existir
-        try:
-            self.processed_dir.mkdir(parents=True, exist_ok=True)
-        except Exception as e:
-            print(f"Erro ao criar pasta Processados: {e}")
-            self.processed_dir = None
-
-    def load_data(self):
-        print("="*80)
-        print(f"PROCESSANDO CONSOLIDAÇÃO {self.marketplace_name.upper()} (Otimizado - Pathlib)...")
-        
-        input_path = Path(self.input_folder)
-        if not input_path.exists():
-            print(f"❌ Pasta de entrada não encontrada: {input_path}")
-            return
-
-        # Lista arquivos na raiz (ignora pastas)
-        arquivos = [
-            f for f in input_path.iterdir() 
-            if f.is_file() and f.suffix.lower() in ['.csv', '.xlsx', '.xls']
-        ]
-        
-        print(f"Encontrados {len(arquivos)} arquivos para processar.")
-        
-        for file_path in arquivos:
-            try:
-                # O método _read_file espera string ou path-like
-                df = self._read_file(str(file_path))
-                
-                if df is not None and not df.empty:
-                    # Padroniza colunas
-                    df.columns = df.columns.str.strip()
-                    self.dfs.append(df)
-                    self.files_to_move.append(file_path) # Guarda objeto Path
-                    print(f" -> Lido com sucesso: {file_path.name}")
-                else:
-                    print(f" -> Arquivo vazio ou ilegível (ignorado): {file_path.name}")
-            except Exception as e:
-                print(f"❌ ERRO CRÍTICO ao ler {file_path.name}: {e}")
-                # Não adiciona a files_to_move
-
-        if not self.dfs:
-            print("❌ Nenhum arquivo novo processado.")
-        else:
-            self.df_final = pd.concat(self.dfs, ignore_index=True)
-
-    def move_processed_files(self):
-        """Move arquivos processados com sucesso para a pasta Processados"""
-        if not self.files_to_move or not self.processed_dir:
-            return
-
-        print("\n" + "-"*40)
-        print("Movendo arquivos processados...")
-        count = 0
-        for src_path in self.files_to_move:
-            dst_path = self.processed_dir / src_path.name
-            
-            try:
-                if dst_path.exists():
-                    dst_path.unlink() # Remove destino se existir
-                
-                shutil.move(str(src_path), str(dst_path))
-                count += 1
-            except Exception as e:
-                print(f"Erro ao mover {src_path.name}: {e}")
-        
-        print(f"Arquivos movidos: {count}/{len(self.files_to_move)}")
-        self.files_to_move = [] # Limpa lista
 
     def _read_file(self, file_path):
         # Olist header=2 e engine=openpyxl
@@ -165,10 +90,6 @@ class OlistProcessor(MarketplaceBase):
             self.df_final['mes'] = 'Desconhecido'
             self.df_final['ano'] = pd.NA
 
-    def process(self):
-        super().process() # Executa fluxo padrão da base
-        self.move_processed_files() # Executa movimentação no final
-
 def processar_olist():
     processor = OlistProcessor()
     processor.process()
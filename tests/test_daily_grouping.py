@@ -0,0 +1,38 @@
+import sqlite3
+import pandas as pd
+import pytest
+
+from api import database
+from api.risk import load_daily_revenue
+from api.cross_elasticity import load_price_panel
+
+
+@pytest.fixture
+def sales_db(tmp_path, monkeypatch):
+    """Banco com 1 venda por dia em 90 dias: a coluna 'dia' (dia do mês) se repete entre meses."""
+    datas = pd.date_range('2024-01-01', periods=90, freq='D')
+    df = pd.DataFrame({
+        'produto': 'Produto A',
+        'marketplace': 'Shopee',
+        'dia': datas.day,
+        'faturamento': 100.0,
+        'contagem_pedidos': 1,
+        'data_filtro': datas.strftime('%Y-%m-%d 00:00:00'),
+    })
+    path = tmp_path / 'vendas_teste.db'
+    with sqlite3.connect(path) as conn:
+        df.to_sql('shopee_consolidado', conn, index=False)
+    monkeypatch.setitem(database.DB_PATHS, 'animoshop', str(path))
+    return df
+
+
+def test_daily_revenue_has_one_row_per_date(sales_db):
+    daily = load_daily_revenue('animoshop', lookback_days=None)
+    assert len(daily) == sales_db['data_filtro'].nunique()
+    assert (daily['Shopee'] == 100.0).all()
+
+
+def test_price_panel_has_one_cell_per_date(sales_db):
+    panel = load_price_panel('animoshop', top_n=5)
+    assert len(panel['days']) == sales_db['data_filtro'].nunique()
+    assert panel['quantity'].nnz == len(sales_db)